@@ -12,16 +12,25 @@ except metadata.PackageNotFoundError:
     # Package is not installed
     pass
 
-from .config import Settings, MatrixConfig, PostgresConfig, LogConfig
-from .logger import setup_logging, get_logger
-from .matrix_to_influx import MatrixInfluxBridge
+from .config import Settings, MatrixConfig, DatabaseConfig, LogConfig
+from .logger import setup_logging, stop_logging, get_logger
 
 __all__ = [
     "Settings",
     "MatrixConfig",
-    "PostgresConfig",
+    "DatabaseConfig",
     "LogConfig",
     "setup_logging",
+    "stop_logging",
     "get_logger",
     "MatrixInfluxBridge",
 ]
+
+
+def __getattr__(name: str):
+    # Defer importing nio and SQLAlchemy until the bridge is actually used
+    if name == "MatrixInfluxBridge":
+        from .matrix_to_influx import MatrixInfluxBridge
+
+        return MatrixInfluxBridge
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,59 @@
+"""Compile a .env file into a Python module for faster startup.
+
+Run ``python -m matrix_influx.compile_env [path/to/.env]`` at build time. The
+module is written outside the package, to ``$MATRIX_INFLUX_COMPILED_ENV`` or
+``env_compiled.py`` in the working directory. ``Settings`` only reads it when
+``MATRIX_INFLUX_COMPILED_ENV`` names it, and uses it in place of parsing
+``.env`` unless ``.env`` has changed since; variables set in the real
+environment still win.
+"""
+
+import argparse
+import os
+from pathlib import Path
+from typing import Optional
+
+from dotenv import dotenv_values
+
+# Environment variable naming the compiled module; Settings ignores it if unset
+COMPILED_ENV_VAR = "MATRIX_INFLUX_COMPILED_ENV"
+
+DEFAULT_OUTPUT = "env_compiled.py"
+
+HEADER = '''"""Generated by matrix_influx.compile_env. Do not edit or commit."""
+
+'''
+
+
+def default_output() -> Path:
+    """Return the path named by COMPILED_ENV_VAR, or DEFAULT_OUTPUT"""
+    return Path(os.environ.get(COMPILED_ENV_VAR) or DEFAULT_OUTPUT)
+
+
+def compile_env(env_file: str = ".env", output: Optional[Path] = None) -> Path:
+    """Write the values of env_file to output as a module-level ENV dict"""
+    if output is None:
+        output = default_output()
+    values = {
+        key: value
+        for key, value in dotenv_values(env_file).items()
+        if value is not None
+    }
+    # Record the source so Settings can tell when the compiled copy is stale
+    source = str(Path(env_file).resolve())
+    output.write_text(HEADER + f"SOURCE = {source!r}\nENV = {values!r}\n")
+    return output
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("env_file", nargs="?", default=".env")
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    path = compile_env(args.env_file, args.output)
+    print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
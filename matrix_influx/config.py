@@ -1,19 +1,54 @@
+import importlib.util
 import os
+import warnings
+from typing import Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from .compile_env import COMPILED_ENV_VAR
+
+
+def load_compiled_env(path: Optional[str] = None) -> Optional[dict]:
+    """Load the ENV dict written by `python -m matrix_influx.compile_env`.
+
+    The module is only used when COMPILED_ENV_VAR names it, and is skipped
+    with a warning once the .env it was built from has changed.
+    """
+    path = path if path is not None else os.environ.get(COMPILED_ENV_VAR)
+    if not path or not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location("_matrix_influx_env", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    source = getattr(module, "SOURCE", None)
+    if source and os.path.exists(source):
+        if os.path.getmtime(source) > os.path.getmtime(path):
+            warnings.warn(
+                f"{source} is newer than {path}; ignoring the compiled copy",
+                stacklevel=2,
+            )
+            return None
+    return module.ENV
+
 
-from pydantic import BaseModel
-from pydantic_settings import BaseSettings
+COMPILED_ENV = load_compiled_env()
 
 
 class MatrixConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     homeserver: str
     user: str
     password: str
-    room_ids: list[str] = []  # Empty list means all accessible rooms
+    room_ids: tuple[str, ...] = ()  # Empty means all accessible rooms
 
 
 class DatabaseConfig(BaseModel):
     """Database configuration supporting both PostgreSQL and SQLite."""
 
+    model_config = ConfigDict(extra="ignore")
+
     type: str = "postgresql"  # Either 'postgresql' or 'sqlite'
     database: str  # Database name for PostgreSQL or file path for SQLite
     host: str = ""  # Only used for PostgreSQL
@@ -21,6 +56,8 @@ class DatabaseConfig(BaseModel):
     user: str = ""  # Only used for PostgreSQL
     password: str = ""  # Only used for PostgreSQL
     store_content: bool = False  # Controls whether message content is stored
+    batch_size: int = 500  # Buffered live messages before a forced flush
+    flush_interval: float = 10.0  # Seconds between background flushes
 
     @property
     def url(self) -> str:
@@ -28,12 +65,27 @@ class DatabaseConfig(BaseModel):
         if self.type == "sqlite":
             return f"sqlite:///{self.database}"
         elif self.type == "postgresql":
-            return f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
+            return f"postgresql+psycopg://{self.user}:{self.password}@{self.host}:{self.port}/{self.database}"
+        else:
+            raise ValueError(f"Unsupported database type: {self.type}")
+
+    @property
+    def engine_options(self) -> dict:
+        """Get keyword arguments for create_engine tuned for batched writes."""
+        if self.type == "sqlite":
+            # Allow flushes from worker threads; SQLite serialises writes itself
+            return {"connect_args": {"check_same_thread": False}}
+        elif self.type == "postgresql":
+            # SQLAlchemy's pool size and insertmanyvalues batching defaults
+            # already suit batched writes; only drop stale connections
+            return {"pool_pre_ping": True}
         else:
             raise ValueError(f"Unsupported database type: {self.type}")
 
 
 class LogConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     file_path: str = "logs/matrix_influx.log"
     max_size_mb: int = 10
     backup_count: int = 5
@@ -43,49 +95,84 @@ class LogConfig(BaseModel):
 class Settings(BaseSettings):
     matrix: MatrixConfig
     database: DatabaseConfig
+    sync_state_backend: Literal["file", "journal", "database"] = "file"
     sync_state_file: str = "matrix_sync_state.json"
-    logging: LogConfig = LogConfig()
+    sync_state_save_interval: float = 5.0  # Minimum seconds between live saves
+    logging: LogConfig = Field(default_factory=LogConfig)
 
-    class Config:
-        env_nested_delimiter = "__"
-        env_file = ".env"
+    model_config = SettingsConfigDict(
+        env_nested_delimiter="__",
+        env_file=".env",
+        extra="ignore",
+    )
 
     def __init__(self, **kwargs):
+        # Snapshot the environment once so every lookup sees the same values
+        env = dict(os.environ)
+        if COMPILED_ENV is not None:
+            # The compiled module replaces parsing .env at startup; real
+            # environment variables still take precedence over it
+            kwargs.setdefault("_env_file", None)
+            for name, value in self._compiled_field_values(env).items():
+                kwargs.setdefault(name, value)
+            env = {**COMPILED_ENV, **env}
+
         # Parse room_ids from environment
         matrix_room_ids = []
-        if "MATRIX_ROOM_IDS" in os.environ:
-            room_ids = os.environ["MATRIX_ROOM_IDS"].strip()
-            if room_ids:
-                matrix_room_ids = [r.strip() for r in room_ids.split(",")]
+        room_ids = env.get("MATRIX_ROOM_IDS", "").strip()
+        if room_ids:
+            matrix_room_ids = [r.strip() for r in room_ids.split(",")]
 
         # Create configs from environment
         matrix_config = MatrixConfig(
-            homeserver=os.environ.get("MATRIX_HOMESERVER", ""),
-            user=os.environ.get("MATRIX_USER", ""),
-            password=os.environ.get("MATRIX_PASSWORD", ""),
+            homeserver=env.get("MATRIX_HOMESERVER", ""),
+            user=env.get("MATRIX_USER", ""),
+            password=env.get("MATRIX_PASSWORD", ""),
             room_ids=matrix_room_ids,
         )
 
         # Create database config from environment
-        db_type = os.environ.get("DATABASE_TYPE", "postgresql")
+        db_type = env.get("DATABASE_TYPE", "postgresql")
+        batch_size = int(env.get("DATABASE_BATCH_SIZE", "500"))
+        flush_interval = float(env.get("DATABASE_FLUSH_INTERVAL", "10.0"))
         if db_type == "postgresql":
             database_config = DatabaseConfig(
                 type="postgresql",
-                host=os.environ.get("POSTGRES_HOST", "localhost"),
-                port=int(os.environ.get("POSTGRES_PORT", "5432")),
-                database=os.environ.get("POSTGRES_DB", ""),
-                user=os.environ.get("POSTGRES_USER", ""),
-                password=os.environ.get("POSTGRES_PASSWORD", ""),
-                store_content=os.environ.get("POSTGRES_STORE_CONTENT", "false").lower() == "true",
+                host=env.get("POSTGRES_HOST", "localhost"),
+                port=int(env.get("POSTGRES_PORT", "5432")),
+                database=env.get("POSTGRES_DB", ""),
+                user=env.get("POSTGRES_USER", ""),
+                password=env.get("POSTGRES_PASSWORD", ""),
+                store_content=env.get("POSTGRES_STORE_CONTENT", "false").lower() == "true",
+                batch_size=batch_size,
+                flush_interval=flush_interval,
             )
         elif db_type == "sqlite":
             database_config = DatabaseConfig(
                 type="sqlite",
-                database=os.environ.get("SQLITE_DB", "matrix_messages.db"),
-                store_content=os.environ.get("SQLITE_STORE_CONTENT", "false").lower() == "true",
+                database=env.get("SQLITE_DB", "matrix_messages.db"),
+                store_content=env.get("SQLITE_STORE_CONTENT", "false").lower() == "true",
+                batch_size=batch_size,
+                flush_interval=flush_interval,
             )
         else:
             raise ValueError(f"Unsupported database type: {db_type}")
 
         # Initialize with parsed configs
         super().__init__(matrix=matrix_config, database=database_config, **kwargs)
+
+    @classmethod
+    def _compiled_field_values(cls, environ: dict) -> dict:
+        """Map compiled .env entries onto fields that pydantic-settings loads."""
+        values: dict = {}
+        for key, value in COMPILED_ENV.items():
+            if key in environ:
+                continue
+            name, _, nested = key.lower().partition("__")
+            if name in ("matrix", "database") or name not in cls.model_fields:
+                continue
+            if nested:
+                values.setdefault(name, {})[nested] = value
+            else:
+                values[name] = value
+        return values
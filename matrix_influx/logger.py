@@ -1,16 +1,29 @@
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
 from .config import Settings
 
+# Background thread that writes queued records to the real handlers
+_listener: Optional[QueueListener] = None
 
-def setup_logging(settings: Settings) -> None:
+
+def setup_logging(settings: Settings) -> QueueListener:
     """Configure logging with both file and console handlers"""
+    global _listener
+
     # Create logs directory if it doesn't exist
     log_path = Path(settings.logging.file_path)
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Records are never formatted with thread or process details, so skip
+    # collecting them for every log call
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
     # Create formatters and handlers
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -33,10 +46,30 @@ def setup_logging(settings: Settings) -> None:
     root_logger = logging.getLogger()
     root_logger.setLevel(getattr(logging, settings.logging.level.upper()))
 
-    # Remove any existing handlers and add our new ones
+    # Stop any previous listener so its handlers are flushed and closed
+    stop_logging()
+
+    # Log calls only enqueue the record; formatting, rotation and I/O
+    # happen on the listener thread
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
     root_logger.handlers.clear()
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(file_handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(
+        log_queue, console_handler, file_handler, respect_handler_level=True
+    )
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """Flush queued log records and stop the background listener"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -1,67 +1,328 @@
 import asyncio
 import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Dict, Optional
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Optional, Union
 
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
 from nio import (
     AsyncClient,
     Event,
+    JoinedRoomsResponse,
     LoginResponse,
     MatrixRoom,
     MessageDirection,
+    RoomMessagesError,
     RoomMessagesResponse,
     RoomMessageText,
+    UploadFilterResponse,
 )
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from nio.client.async_client import connect_wrapper, on_request_chunk_sent
+from sqlalchemy import Insert, create_engine, insert, select
+from sqlalchemy import event as sa_event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
+
+try:
+    import orjson
+except ImportError:  # Optional speedup, fall back to the standard library
+    orjson = None
 
 from .config import Settings
-from .logger import get_logger, setup_logging
-from .schema import Base, Message
+from .logger import get_logger, setup_logging, stop_logging
+from .schema import Base, Message, SyncState, upgrade_schema
 
 # Create logger for this module
 logger = get_logger(__name__)
 
+# Upper bound on rows sent to the database in a single INSERT
+MAX_BATCH_SIZE = 500
+
+# Number of events requested per page of room history
+HISTORY_PAGE_SIZE = 500
+
+# Upper bound on rooms whose history is fetched at the same time
+MAX_CONCURRENT_FETCHES = 8
+
+# Worker threads that run database writes off the event loop
+DB_WRITE_WORKERS = 4
+
+# Journal appends between rewrites of the full sync state snapshot
+SYNC_STATE_COMPACT_EVERY = 100
+
+# Seconds an idle homeserver connection is kept for reuse
+HTTP_KEEPALIVE_TIMEOUT = 60.0
+
+# Only message events are stored, so skip presence, account data and full
+# member lists when syncing
+SYNC_FILTER_EVENT_TYPES = ["m.room.message"]
+
+# Column values for a single matrix_messages row
+MessageRow = Dict[str, Any]
+
+# Coroutine that stores one event for a room
+EventHandler = Callable[[str, Any], Awaitable[None]]
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """Serialize obj to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    # Match orjson's compact output so both produce the same file
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _json_loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _insert_messages(database_type: str) -> Insert:
+    """Build the message INSERT, skipping events that are already stored"""
+    # Live sync and the history backfill overlap, so both may deliver an event
+    if database_type == "postgresql":
+        statement = postgresql.insert(Message)
+    elif database_type == "sqlite":
+        statement = sqlite.insert(Message)
+    else:
+        return insert(Message)
+    return statement.on_conflict_do_nothing(index_elements=["event_id"])
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """Use WAL journaling so small frequent commits don't rewrite the database"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 
 class MatrixInfluxBridge:
+    __slots__ = (
+        "settings",
+        "matrix_client",
+        "engine",
+        "session_maker",
+        "_insert_message",
+        "room_sync_times",
+        "last_sync_time",
+        "pending_messages",
+        "monitored_rooms",
+        "_flush_task",
+        "_io_pool",
+        "_sync_state_dirty",
+        "_last_sync_state_save",
+        "_saved_sync_times",
+        "_journal_entries",
+        "_event_handlers",
+    )
+
     def __init__(self, settings: Settings) -> None:
         self.settings: Settings = settings
         self.matrix_client: AsyncClient = AsyncClient(
             settings.matrix.homeserver, settings.matrix.user
         )
-        self.engine = create_engine(settings.database.url)
+        self.engine = create_engine(
+            settings.database.url, **settings.database.engine_options
+        )
+        if settings.database.type == "sqlite":
+            sa_event.listen(self.engine, "connect", _configure_sqlite_connection)
         Base.metadata.create_all(self.engine)
+        upgrade_schema(self.engine)
+        self.session_maker = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self._insert_message = _insert_messages(settings.database.type)
         self.room_sync_times: Dict[str, Optional[int]] = {}
         self.last_sync_time: Optional[int] = None
+        self.pending_messages: List[MessageRow] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=DB_WRITE_WORKERS, thread_name_prefix="matrix-influx-db"
+        )
+        self._sync_state_dirty = False
+        self._last_sync_state_save = 0.0
+        self._saved_sync_times: Dict[str, Optional[int]] = {}
+        self._journal_entries = 0
+        # Stored event types, keyed by exact type so dispatch is one lookup
+        self._event_handlers: Dict[type, EventHandler] = {
+            RoomMessageText: self.handle_message,
+        }
 
-        if not settings.matrix.room_ids:
-            self.monitored_rooms = set(self.matrix_client.rooms.keys())
-        else:
-            self.monitored_rooms = set(settings.matrix.room_ids)
+        self.monitored_rooms: FrozenSet[str] = frozenset(
+            settings.matrix.room_ids or self.matrix_client.rooms.keys()
+        )
         self.load_sync_state()
 
     def load_sync_state(self) -> None:
         """Load the last sync timestamp for each room from file"""
+        if self.settings.sync_state_backend == "database":
+            self._load_sync_state_from_db()
+        else:
+            self._load_sync_state_from_file()
+            if self.settings.sync_state_backend == "journal":
+                self._replay_sync_state_journal()
+        self._log_sync_state()
+
+    def _load_sync_state_from_file(self) -> None:
+        """Load the last sync timestamp for each room from the snapshot file"""
         try:
-            with open(self.settings.sync_state_file, "r") as f:
-                state = json.load(f)
-                self.room_sync_times = {room: ts for room, ts in state.items()}
-                for room_id, timestamp in self.room_sync_times.items():
-                    logger.info(f"Room {room_id} last sync time: {timestamp}")
+            with open(self.settings.sync_state_file, "rb") as f:
+                self.room_sync_times = _json_loads(f.read())
         except FileNotFoundError:
             logger.info("No previous sync state found")
             self.room_sync_times = {}
-        except json.JSONDecodeError:
+        except ValueError:
+            # JSONDecodeError, or UnicodeDecodeError from the json fallback
             logger.warning("Corrupted sync state file found, starting fresh")
             self.room_sync_times = {}
 
+    def _load_sync_state_from_db(self) -> None:
+        """Load the last sync timestamp for each room from the database"""
+        with self.session_maker() as session:
+            rows = session.execute(select(SyncState)).scalars().all()
+            self.room_sync_times = {row.room_id: row.sync_token for row in rows}
+        self._saved_sync_times = dict(self.room_sync_times)
+        if not self.room_sync_times:
+            logger.info("No previous sync state found")
+
+    def _log_sync_state(self) -> None:
+        """Log the loaded sync position of every room"""
+        # Skip formatting one line per room entirely when INFO is disabled
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        for room_id, token in self.room_sync_times.items():
+            logger.info("Room %s last sync time: %s", room_id, token or "Never")
+
+    @property
+    def _journal_path(self) -> str:
+        """Path of the append-only log of sync state changes"""
+        return f"{self.settings.sync_state_file}.log"
+
+    def _replay_sync_state_journal(self) -> None:
+        """Apply the changes appended to the journal since the last snapshot"""
+        entries = 0
+        torn = False
+        try:
+            with open(self._journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        self.room_sync_times.update(_json_loads(line))
+                    except ValueError:
+                        # A crash mid-append leaves at most one torn last line
+                        logger.warning("Ignoring truncated sync state journal entry")
+                        torn = True
+                        break
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        self._journal_entries = entries
+        self._saved_sync_times = dict(self.room_sync_times)
+        if torn:
+            # Later appends would land on the torn line, so compact it away now
+            self._compact_sync_state_journal()
+
+    def _changed_sync_times(self) -> Dict[str, Optional[int]]:
+        """Return the sync timestamps that changed since the last save"""
+        return {
+            room_id: token
+            for room_id, token in self.room_sync_times.items()
+            if room_id not in self._saved_sync_times
+            or self._saved_sync_times[room_id] != token
+        }
+
+    def _save_sync_state_to_db(self) -> None:
+        """Upsert the sync timestamps that changed since the last save"""
+        changed = self._changed_sync_times()
+        if changed:
+            with self.session_maker() as session:
+                for room_id, token in changed.items():
+                    session.merge(
+                        SyncState(
+                            room_id=room_id,
+                            sync_token=None if token is None else str(token),
+                        )
+                    )
+                session.commit()
+            self._saved_sync_times.update(changed)
+
     def save_sync_state(self) -> None:
+        """Save the current sync timestamp for each room"""
+        if self.settings.sync_state_backend == "database":
+            self._save_sync_state_to_db()
+        elif self.settings.sync_state_backend == "journal":
+            self._save_sync_state_to_journal()
+        else:
+            self._save_sync_state_to_file()
+        self._sync_state_dirty = False
+        self._last_sync_state_save = time.monotonic()
+
+    def _save_sync_state_to_file(self) -> None:
         """Save the current sync timestamp for each room to file"""
-        with open(self.settings.sync_state_file, "w") as f:
-            json.dump(self.room_sync_times, f)
+        # Write to a temporary file and rename it so a crash mid-write
+        # never leaves a truncated state file behind. The name is unique so
+        # concurrent writers never truncate each other's temporary file.
+        state_file = self.settings.sync_state_file
+        state_dir = os.path.dirname(state_file) or "."
+        fd, tmp_path = tempfile.mkstemp(
+            dir=state_dir,
+            prefix=f"{os.path.basename(state_file)}.",
+            suffix=".tmp",
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_json_dumps(self.room_sync_times))
+                # Make the data durable before the rename publishes it
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, state_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # The rename lives in the directory, so sync that too to make it durable
+        dir_fd = os.open(state_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _save_sync_state_to_journal(self) -> None:
+        """Append the sync timestamps that changed since the last save"""
+        changed = self._changed_sync_times()
+        if changed:
+            with open(self._journal_path, "ab") as f:
+                f.write(_json_dumps(changed) + b"\n")
+                # Make the entry durable before it counts as saved
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal_entries += 1
+            self._saved_sync_times.update(changed)
+
+        if self._journal_entries >= SYNC_STATE_COMPACT_EVERY:
+            self._compact_sync_state_journal()
+
+    def _compact_sync_state_journal(self) -> None:
+        """Fold the journal into a fresh snapshot and start a new journal"""
+        # Every change is journaled before the snapshot is written, so
+        # replaying a journal left behind by a crash here is harmless
+        self._save_sync_state_to_file()
+        os.remove(self._journal_path)
+        self._journal_entries = 0
+
+    def _maybe_save_sync_state(self) -> None:
+        """Save the sync state if it changed and the save interval has elapsed"""
+        elapsed = time.monotonic() - self._last_sync_state_save
+        if self._sync_state_dirty and elapsed >= self.settings.sync_state_save_interval:
+            self.save_sync_state()
 
     async def connect_to_matrix(self) -> None:
         """Connect to Matrix server and join the specified room"""
+        self._open_http_session()
         logger.info(f"Logging in to Matrix as {self.settings.matrix.user}...")
         response: LoginResponse = await self.matrix_client.login(
             password=self.settings.matrix.password
@@ -73,6 +334,104 @@ class MatrixInfluxBridge:
             raise Exception(f"Failed to log in: {response.transport_response.status}")
         logger.info("Successfully logged in")
 
+        # Without configured rooms, ask for the joined rooms directly rather
+        # than waiting for them to arrive in a full initial sync
+        if not self.settings.matrix.room_ids:
+            await self.load_joined_rooms()
+
+    async def load_joined_rooms(self) -> None:
+        """Monitor every room the account has joined"""
+        response = await self.matrix_client.joined_rooms()
+        if not isinstance(response, JoinedRoomsResponse):
+            logger.warning(f"Failed to list joined rooms: {response}")
+            return
+        self.monitored_rooms = frozenset(response.rooms)
+
+    def _open_http_session(self) -> None:
+        """Give the Matrix client a pooled session that keeps connections alive"""
+        client = self.matrix_client
+        # nio builds its own session lazily; a proxied client keeps that one
+        if client.client_session is not None or client.proxy:
+            return
+        # Mirror nio's own session setup: upload progress tracing and the
+        # smaller write buffer its connect wrapper sets on each connection
+        trace = TraceConfig()
+        trace.on_request_chunk_sent.append(on_request_chunk_sent)
+        client.client_session = ClientSession(
+            connector=TCPConnector(keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT),
+            timeout=ClientTimeout(total=client.config.request_timeout),
+            trace_configs=[trace],
+        )
+        client.client_session.connector.connect = partial(
+            connect_wrapper, client.client_session.connector
+        )
+
+    async def upload_sync_filter(self) -> Optional[str]:
+        """Upload a sync filter limited to the events this bridge stores"""
+        room_filter: Dict[str, Any] = {
+            "timeline": {"types": SYNC_FILTER_EVENT_TYPES, "lazy_load_members": True},
+            "state": {"lazy_load_members": True},
+            "ephemeral": {"types": []},
+            "account_data": {"types": []},
+        }
+        if self.settings.matrix.room_ids:
+            room_filter["rooms"] = list(self.monitored_rooms)
+
+        response = await self.matrix_client.upload_filter(
+            presence={"types": []},
+            account_data={"types": []},
+            room=room_filter,
+        )
+        if not isinstance(response, UploadFilterResponse):
+            logger.warning(f"Failed to upload sync filter, syncing unfiltered: {response}")
+            return None
+        return response.filter_id
+
+    def build_message_row(
+        self,
+        room_id: str,
+        sender: str,
+        message: str,
+        timestamp: datetime,
+        message_type: str,
+        event_id: Optional[str] = None,
+    ) -> MessageRow:
+        """Build the column values for a Matrix message"""
+        return {
+            "event_id": event_id,
+            "room_id": room_id,
+            "sender": sender,
+            "message_type": message_type,
+            "content": message if self.settings.database.store_content else None,
+            "content_length": len(message),
+            "timestamp": timestamp,
+        }
+
+    def build_room_rows(self, room_id: str, events: List[Event]) -> List[MessageRow]:
+        """Build the column values for every stored event in a room's events"""
+        # Everything but the event's own fields is the same for the room
+        store_content = self.settings.database.store_content
+        # Bind the conversion once; this is the fastest pure-Python ms -> datetime
+        # path (an integer timedelta offset from the epoch is slower)
+        fromtimestamp = datetime.fromtimestamp
+        utc = timezone.utc
+        handlers = self._event_handlers
+        return [
+            {
+                "event_id": event.event_id,
+                "room_id": room_id,
+                "sender": event.sender,
+                # Label each row with its own event type, as handle_message does
+                "message_type": type(event).__name__,
+                "content": event.body if store_content else None,
+                "content_length": len(event.body),
+                "timestamp": fromtimestamp(event.server_timestamp / 1000, tz=utc),
+            }
+            for event in events
+            # Exact type lookup, like the live dispatch in message_callback
+            if type(event) in handlers
+        ]
+
     def store_message_in_db(
         self,
         room_id: str,
@@ -80,101 +439,230 @@ class MatrixInfluxBridge:
         message: str,
         timestamp: datetime,
         message_type: str,
+        event_id: Optional[str] = None,
     ) -> None:
-        """Store a Matrix message in PostgreSQL"""
-        with Session(self.engine) as session:
-            msg = Message(
-                room_id=room_id,
-                sender=sender,
-                message_type=message_type,
-                content=message if self.settings.postgres.store_content else None,
-                content_length=len(message),
-                timestamp=timestamp,
-            )
-            session.add(msg)
+        """Store a Matrix message in the database"""
+        self.store_messages_in_db(
+            [
+                self.build_message_row(
+                    room_id, sender, message, timestamp, message_type, event_id
+                )
+            ]
+        )
+
+    def store_messages_in_db(self, messages: List[MessageRow]) -> None:
+        """Store a batch of Matrix messages with a single multi-row INSERT"""
+        if not messages:
+            return
+        with self.session_maker() as session:
+            for start in range(0, len(messages), MAX_BATCH_SIZE):
+                session.execute(
+                    self._insert_message, messages[start : start + MAX_BATCH_SIZE]
+                )
             session.commit()
 
+    def flush_messages(self) -> None:
+        """Write any buffered live messages to the database"""
+        messages, self.pending_messages = self.pending_messages, []
+        try:
+            self.store_messages_in_db(messages)
+        except Exception:
+            # Keep the rows, ahead of any that arrived since, for the next flush
+            self.pending_messages[:0] = messages
+            raise
+
+    async def flush_messages_in_background(self) -> None:
+        """Write buffered live messages from a worker thread"""
+        messages, self.pending_messages = self.pending_messages, []
+        if not messages:
+            return
+        # Keep the event loop free to receive events while the INSERT runs
+        try:
+            await self._store_messages_off_loop(messages)
+        except Exception:
+            self.pending_messages[:0] = messages
+            raise
+
+    async def _store_messages_off_loop(self, messages: List[MessageRow]) -> None:
+        """Run store_messages_in_db on the database write pool"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._io_pool, self.store_messages_in_db, messages)
+
+    async def _flush_periodically(self) -> None:
+        """Flush buffered messages and sync state every flush_interval seconds"""
+        while True:
+            await asyncio.sleep(self.settings.database.flush_interval)
+            try:
+                await self.flush_messages_in_background()
+                # Checkpoint the tail of a burst that arrived within the save interval
+                self._maybe_save_sync_state()
+            except Exception:
+                # Keep flushing; failed rows stay buffered for the next attempt
+                logger.exception("Periodic flush failed")
+
+    async def close(self) -> None:
+        """Flush buffered messages and release client resources"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            # Let a flush that is mid-write finish unwinding before the final one
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            try:
+                self.flush_messages()
+            except Exception:
+                # Still save progress and release the clients below
+                logger.exception(
+                    "Final flush failed, %d messages were not stored",
+                    len(self.pending_messages),
+                )
+            # Wait for writes still running on the pool before saving progress,
+            # without blocking the event loop while they finish
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, partial(self._io_pool.shutdown, wait=True)
+            )
+            if self._sync_state_dirty:
+                self.save_sync_state()
+        finally:
+            await self.matrix_client.close()
+            self.engine.dispose()
+
     async def message_callback(self, room: MatrixRoom, event: Event) -> None:
         """Callback for new messages"""
-        if isinstance(event, RoomMessageText):
+        handler = self._event_handlers.get(type(event))
+        if handler is None:
+            return
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
-                f"New message in {room.room_id} from {event.sender}: {event.body}"
+                "New message in %s from %s: %s",
+                room.room_id,
+                event.sender,
+                event.body,
             )
-            await self.handle_message(room.room_id, event)
+        await handler(room.room_id, event)
 
-            # Update sync state with the latest message timestamp
-            self.last_sync_time = max(event.server_timestamp, self.last_sync_time or 0)
-            self.save_sync_state()
+        # Update sync state with the latest message timestamp
+        self.last_sync_time = max(event.server_timestamp, self.last_sync_time or 0)
+        self._sync_state_dirty = True
+        self._maybe_save_sync_state()
 
     async def fetch_historical_messages(self) -> None:
         """Fetch messages from all monitored rooms since their last sync time"""
-        for room_id in self.monitored_rooms:
-            last_sync = self.room_sync_times.get(room_id)
-            if not last_sync:
-                logger.info(
-                    f"No previous sync time for room {room_id}, fetching all available messages..."
-                )
-            else:
-                logger.info(f"Fetching messages for room {room_id} since {last_sync}")
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
 
-            try:
-                # Fetch messages since last sync
-                response = await self.matrix_client.room_messages(
-                    room_id=room_id,
-                    start=None if not last_sync else str(last_sync),
-                    limit=100,
-                    direction=MessageDirection.front,
-                )
+        async def fetch(room_id: str) -> None:
+            async with semaphore:
+                await self._fetch_room_history(room_id)
+
+        try:
+            # Rooms are independent, so overlap their network round-trips and
+            # let every room finish even if one of them fails
+            results = await asyncio.gather(
+                *(fetch(room_id) for room_id in self.monitored_rooms),
+                return_exceptions=True,
+            )
+        finally:
+            # Persist progress once, even if one of the rooms failed
+            if self._sync_state_dirty:
+                self.save_sync_state()
+
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _fetch_room_history(self, room_id: str) -> None:
+        """Fetch and store messages for one room since its last sync time"""
+        last_sync = self.room_sync_times.get(room_id)
+        if not last_sync:
+            logger.info(
+                f"No previous sync time for room {room_id}, fetching all available messages..."
+            )
+        else:
+            logger.info(f"Fetching messages for room {room_id} since {last_sync}")
 
-                if isinstance(response, RoomMessagesResponse):
-                    for event in response.chunk:
-                        if isinstance(event, RoomMessageText):
-                            # Store message in PostgreSQL
-                            self.store_message_in_db(
-                                room_id=room_id,
-                                sender=event.source.get("sender", event.sender),
-                                message=event.body,
-                                timestamp=datetime.fromtimestamp(
-                                    event.source.get(
-                                        "origin_server_ts", event.server_timestamp
-                                    )
-                                    / 1000,
-                                    tz=timezone.utc,
-                                ),
-                                message_type=type(event).__name__,
-                            )
-                            logger.debug(
-                                f"Wrote message from {event.sender} in room {room_id} to PostgreSQL"
-                            )
-
-                    # Update sync time for this room
-                    if response.chunk:
-                        self.room_sync_times[room_id] = response.end
-                        self.save_sync_state()
-
-                else:
+        token = None if not last_sync else str(last_sync)
+        next_page: Optional[asyncio.Task] = None
+        try:
+            # Fetch messages since last sync, one page at a time
+            response = await self._fetch_page(room_id, token)
+            while True:
+                if not isinstance(response, RoomMessagesResponse):
                     logger.error(
                         f"Failed to fetch messages from room {room_id}: {response}"
                     )
+                    return
 
-            except Exception as e:
-                logger.error(f"Error fetching messages from room {room_id}: {e}")
-                raise
+                # Stop once the server has nothing newer for us
+                if not response.chunk or response.end in (None, token):
+                    return
 
-    async def handle_message(self, room_id: str, event: RoomMessageText) -> None:
-        """Process a single message event"""
-        # Store message in PostgreSQL
-        self.store_message_in_db(
+                # Request the next page while this one is being stored
+                next_page = asyncio.create_task(
+                    self._fetch_page(room_id, response.end)
+                )
+                await asyncio.sleep(0)
+
+                messages = self.build_room_rows(room_id, response.chunk)
+                await self._store_messages_off_loop(messages)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Wrote %d messages from room %s to the database",
+                        len(messages),
+                        room_id,
+                    )
+
+                # Update sync time for this room
+                token = response.end
+                self.room_sync_times[room_id] = token
+                self._sync_state_dirty = True
+
+                response = await next_page
+                next_page = None
+
+        except Exception as e:
+            logger.error(f"Error fetching messages from room {room_id}: {e}")
+            raise
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def _fetch_page(
+        self, room_id: str, token: Optional[str]
+    ) -> Union[RoomMessagesResponse, RoomMessagesError]:
+        """Fetch one page of room history going forward from token"""
+        return await self.matrix_client.room_messages(
             room_id=room_id,
-            sender=event.source.get("sender", event.sender),
-            message=event.body,
-            timestamp=datetime.fromtimestamp(
-                event.source.get("origin_server_ts", event.server_timestamp) / 1000,
-                tz=timezone.utc,
-            ),
-            message_type=type(event).__name__,
+            start=token,
+            limit=HISTORY_PAGE_SIZE,
+            direction=MessageDirection.front,
         )
 
+    async def handle_message(self, room_id: str, event: RoomMessageText) -> None:
+        """Buffer a single message event, flushing once the batch is full"""
+        self.pending_messages.append(
+            self.build_message_row(
+                room_id=room_id,
+                sender=event.sender,
+                message=event.body,
+                timestamp=datetime.fromtimestamp(
+                    event.server_timestamp / 1000, tz=timezone.utc
+                ),
+                message_type=type(event).__name__,
+                event_id=event.event_id,
+            )
+        )
+        if len(self.pending_messages) >= self.settings.database.batch_size:
+            try:
+                await self.flush_messages_in_background()
+            except Exception:
+                # Raising here would end nio's sync loop; the rows stay
+                # buffered and the next flush retries them
+                logger.exception("Flushing a full batch failed")
+
     async def run(self) -> None:
         """Main run loop"""
         await self.connect_to_matrix()
@@ -184,15 +672,29 @@ class MatrixInfluxBridge:
             await self.matrix_client.join(room_id)
             logger.info(f"Monitoring room {room_id}")
 
-        # Fetch historical messages first
-        await self.fetch_historical_messages()
-
         # Add message callback for new messages
-        self.matrix_client.add_event_callback(self.message_callback, RoomMessageText)
+        self.matrix_client.add_event_callback(
+            self.message_callback, tuple(self._event_handlers)
+        )
+        self._flush_task = asyncio.create_task(self._flush_periodically())
 
-        # Start syncing
+        # Start syncing right away so live messages are captured during backfill
+        sync_filter = await self.upload_sync_filter()
         logger.info("Starting sync loop for new messages...")
-        await self.matrix_client.sync_forever(timeout=30000)
+        sync_task = asyncio.create_task(
+            self.matrix_client.sync_forever(timeout=30000, sync_filter=sync_filter)
+        )
+        backfill_task = asyncio.create_task(self.fetch_historical_messages())
+        tasks = (sync_task, backfill_task)
+        try:
+            # Surface a failure of either one right away, not after the other
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
 
 async def main() -> None:
@@ -208,7 +710,8 @@ async def main() -> None:
     except KeyboardInterrupt:
         logger.info("Shutting down...")
     finally:
-        await bridge.matrix_client.close()
+        await bridge.close()
+        stop_logging()
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@
 
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlalchemy import Column, DateTime, Engine, Integer, String, Text, inspect, text
 from sqlalchemy.orm import DeclarativeBase
 
 
@@ -16,6 +16,8 @@ class Message(Base):
     __tablename__ = "matrix_messages"
 
     id = Column(Integer, primary_key=True)
+    # Matrix event ID; unique so overlapping backfill and live sync store once
+    event_id = Column(String(255), nullable=True, unique=True, index=True)
     room_id = Column(String(255), nullable=False, index=True)
     sender = Column(String(255), nullable=False, index=True)
     message_type = Column(String(50), nullable=False)
@@ -25,3 +27,35 @@ class Message(Base):
     created_at = Column(
         DateTime(timezone=True), nullable=False, default=datetime.utcnow
     )
+
+
+class SyncState(Base):
+    """Last sync position for a monitored Matrix room."""
+
+    __tablename__ = "matrix_sync_state"
+
+    room_id = Column(String(255), primary_key=True)
+    sync_token = Column(String(255), nullable=True)
+
+
+def upgrade_schema(engine: Engine) -> None:
+    """Add columns introduced since a deployment first created its tables.
+
+    create_all only creates missing tables, so a matrix_messages table from
+    before event_id existed is altered here. Rows stored before the upgrade
+    keep a NULL event_id, which the unique index allows any number of.
+    """
+    table = Message.__tablename__
+    columns = {column["name"] for column in inspect(engine).get_columns(table)}
+    if "event_id" in columns:
+        return
+    with engine.begin() as connection:
+        connection.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN event_id VARCHAR(255)")
+        )
+        connection.execute(
+            text(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS ix_{table}_event_id "
+                f"ON {table} (event_id)"
+            )
+        )
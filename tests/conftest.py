@@ -1,11 +1,15 @@
 """Common test fixtures for matrix-to-influx tests."""
 
-import os
+from datetime import datetime, timezone
 from pathlib import Path
+from unittest.mock import MagicMock
 import pytest
 from pytest_mock import MockerFixture
+from nio import RoomMessageEmote, RoomMessageNotice, RoomMessageText
+from sqlalchemy.orm import Session
 
 from matrix_influx.config import Settings
+from matrix_influx.matrix_to_influx import MatrixInfluxBridge
 
 
 @pytest.fixture
@@ -14,32 +18,154 @@ def temp_dir(tmp_path: Path) -> Path:
     return tmp_path
 
 
+# Millisecond Matrix timestamp shared by the test events
+TIMESTAMP_MS = int(datetime.now(timezone.utc).timestamp() * 1000)
+
+# Environment the unit tests configure Settings from
+TEST_ENV = {
+    "MATRIX_HOMESERVER": "https://test.matrix.org",
+    "MATRIX_USER": "@test:matrix.org",
+    "MATRIX_PASSWORD": "test_password",
+    "MATRIX_ROOM_IDS": "!test1:matrix.org,!test2:matrix.org",
+    "DATABASE_TYPE": "sqlite",
+    "SQLITE_STORE_CONTENT": "true",
+}
+
+
+@pytest.fixture(scope="session")
+def base_settings() -> Settings:
+    """Parse and validate the test settings once per session."""
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in TEST_ENV.items():
+            mp.setenv(name, value)
+        return Settings()
+
+
 @pytest.fixture
-def test_settings(temp_dir: Path) -> Settings:
+def test_settings(
+    base_settings: Settings, temp_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> Settings:
     """Create test settings with mock values using SQLite."""
-    os.environ.update(
-        {
-            "MATRIX_HOMESERVER": "https://test.matrix.org",
-            "MATRIX_USER": "@test:matrix.org",
-            "MATRIX_PASSWORD": "test_password",
-            "MATRIX_ROOM_IDS": "!test1:matrix.org,!test2:matrix.org",
-            "DATABASE_TYPE": "sqlite",
-            "SQLITE_DB": str(temp_dir / "test.db"),
-            "SQLITE_STORE_CONTENT": "true",
-        }
-    )
+    # Tests that build their own Settings() still read the same environment
+    for name, value in {**TEST_ENV, "SQLITE_DB": str(temp_dir / "test.db")}.items():
+        monkeypatch.setenv(name, value)
 
-    settings = Settings()
+    settings = base_settings.model_copy(deep=True)
+    settings.database.database = str(temp_dir / "test.db")
     settings.sync_state_file = str(temp_dir / "test_sync_state.json")
     settings.logging.file_path = str(temp_dir / "test.log")
     return settings
 
 
+@pytest.fixture(scope="module")
+def _mocked_sa() -> MagicMock:
+    """Build the Session mock once per module, as spec=Session is slow to build."""
+    return MagicMock(spec=Session)
+
+
+@pytest.fixture
+def mock_session(_mocked_sa: MagicMock) -> MagicMock:
+    """Provide the shared Session mock, reset for this test."""
+    _mocked_sa.reset_mock(return_value=True, side_effect=True)
+    _mocked_sa.__enter__.return_value = _mocked_sa
+    _mocked_sa.__exit__.return_value = None
+    return _mocked_sa
+
+
 @pytest.fixture
-def mock_matrix_client(mocker: MockerFixture):
-    """Create a mock Matrix client."""
-    return mocker.patch("nio.AsyncClient", autospec=True)
+def make_bridge(test_settings: Settings):
+    """Create bridges on test_settings, disposing their engines afterwards."""
+    bridges = []
 
+    def make() -> MatrixInfluxBridge:
+        bridge = MatrixInfluxBridge(test_settings)
+        bridges.append(bridge)
+        return bridge
+
+    yield make
+    for bridge in bridges:
+        bridge.engine.dispose()
+
+
+@pytest.fixture
+def bridge(make_bridge, mock_session: MagicMock):
+    """Create a test bridge instance with a mocked session factory."""
+    # The engine is a real SQLite file under tmp_path; only sessions are mocked
+    bridge = make_bridge()
+    bridge.session_maker = MagicMock(return_value=mock_session)
+    return bridge
+
+
+@pytest.fixture
+def mock_settings(mocker: MockerFixture, request):
+    """Create mocked settings for testing."""
+    settings = mocker.MagicMock()
+    settings.matrix = mocker.MagicMock()
+    settings.database = mocker.MagicMock()
+    settings.database.batch_size = 500
+    # Allow parametrizing store_content
+    settings.database.store_content = getattr(request, "param", {}).get(
+        "store_content", False
+    )
+    return settings
+
+
+@pytest.fixture(scope="session")
+def mock_messages():
+    """Create a set of test messages shared by the whole session."""
+    # Shared across tests: do not mutate the list or its events
+    return [
+        RoomMessageText(
+            source={
+                "event_id": "$event1:matrix.org",
+                "sender": "@test:matrix.org",
+                "origin_server_ts": TIMESTAMP_MS,
+            },
+            body="test message",
+            formatted_body="<p>test message</p>",
+            format="org.matrix.custom.html",
+        ),
+        RoomMessageEmote(
+            source={
+                "event_id": "$event2:matrix.org",
+                "sender": "@test2:matrix.org",
+                "origin_server_ts": TIMESTAMP_MS + 1000,
+            },
+            body="waves hello",
+            formatted_body="<em>waves hello</em>",
+            format="org.matrix.custom.html",
+        ),
+        RoomMessageText(
+            source={
+                "event_id": "$event3:matrix.org",
+                "sender": "@test3:matrix.org",
+                "origin_server_ts": TIMESTAMP_MS + 1500,
+            },
+            body="test message 2",
+            formatted_body="<p>test message 2</p>",
+            format="org.matrix.custom.html",
+        ),
+        RoomMessageText(
+            source={
+                "event_id": "$event4:matrix.org",
+                "sender": "@test4:matrix.org",
+                "origin_server_ts": TIMESTAMP_MS + 2000,
+            },
+            body="test message 3",
+            formatted_body="<p>test message 3</p>",
+            format="org.matrix.custom.html",
+        ),
+        RoomMessageNotice(
+            source={
+                "event_id": "$event5:matrix.org",
+                "sender": "@system:matrix.org",
+                "origin_server_ts": TIMESTAMP_MS + 2000,
+            },
+            body="System notice",
+            formatted_body="<strong>System notice</strong>",
+            format="org.matrix.custom.html",
+        ),
+    ]
 
 
 @pytest.fixture(scope="session")
@@ -6,6 +6,11 @@ from pathlib import Path
 from typing import Generator
 import time
 
+from sqlalchemy import create_engine
+
+from matrix_influx.config import DatabaseConfig
+from matrix_influx.schema import Base
+
 
 @pytest.fixture(scope="session")
 def influxdb_container() -> Generator[dict, None, None]:
@@ -42,6 +47,66 @@ def influxdb_container() -> Generator[dict, None, None]:
         container.stop()
 
 
+@pytest.fixture(scope="session")
+def postgres_container() -> Generator[dict, None, None]:
+    """Start PostgreSQL container for integration tests."""
+    client = docker.from_env()
+
+    container = client.containers.run(
+        "postgres:16",
+        detach=True,
+        remove=True,
+        environment={
+            "POSTGRES_USER": "test",
+            "POSTGRES_PASSWORD": "test123",
+            "POSTGRES_DB": "matrix_messages",
+        },
+        ports={"5432/tcp": 5432},
+    )
+
+    # Wait for PostgreSQL to accept connections
+    for _ in range(30):
+        if container.exec_run(["pg_isready", "-U", "test"]).exit_code == 0:
+            break
+        time.sleep(1)
+    else:
+        container.stop()
+        raise TimeoutError("PostgreSQL failed to start within the expected time")
+
+    config = DatabaseConfig(
+        type="postgresql",
+        host="localhost",
+        port=5432,
+        database="matrix_messages",
+        user="test",
+        password="test123",
+    )
+    try:
+        yield {
+            "host": config.host,
+            "port": config.port,
+            "database": config.database,
+            "user": config.user,
+            "password": config.password,
+            # Connect the way the bridge does, so a wrong driver fails here too
+            "url": config.url,
+        }
+    finally:
+        container.stop()
+
+
+@pytest.fixture
+def reset_postgres(postgres_container) -> Generator[None, None, None]:
+    """Empty the bridge tables so each test starts from a clean database."""
+    engine = create_engine(postgres_container["url"])
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    engine.dispose()
+    yield
+
+
 @pytest.fixture(scope="session")
 def synapse_container() -> Generator[dict, None, None]:
     """Start Synapse container for integration tests."""
@@ -1,17 +1,71 @@
 """Integration tests for the full Matrix to PostgreSQL pipeline."""
 
-import os
 import asyncio
+from typing import Awaitable, Callable
 from nio.responses import LoginError, LoginResponse
 import pytest
-from nio import AsyncClient, RoomVisibility
-from sqlalchemy import create_engine, select
+from nio import AsyncClient, RoomMessageText, RoomVisibility
+from sqlalchemy import func, select, tuple_
 from sqlalchemy.orm import Session
 
 from matrix_influx.config import Settings
 from matrix_influx.matrix_to_influx import MatrixInfluxBridge
 from matrix_influx.schema import Message
 
+# Cap in-flight sends so synapse does not rate limit the test user
+MAX_CONCURRENT_SENDS = 16
+
+
+async def send_messages(client: AsyncClient, messages: list[tuple[str, str]]) -> None:
+    """Send (room_id, body) text messages concurrently."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+
+    async def send(room_id: str, body: str) -> None:
+        async with semaphore:
+            await client.room_send(
+                room_id=room_id,
+                message_type="m.room.message",
+                content={"msgtype": "m.text", "body": body},
+            )
+
+    await asyncio.gather(*(send(room_id, body) for room_id, body in messages))
+
+
+async def wait_until(
+    predicate: Callable[[], Awaitable[bool]],
+    timeout: float = 10.0,
+    interval: float = 0.05,
+) -> None:
+    """Poll predicate until it returns True, failing after timeout seconds."""
+
+    async def poll() -> None:
+        while not await predicate():
+            await asyncio.sleep(interval)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def stored_message_count(bridge: MatrixInfluxBridge) -> int:
+    """Count the messages the bridge has written to the database."""
+    with Session(bridge.engine) as session:
+        return session.execute(select(func.count()).select_from(Message)).scalar_one()
+
+
+async def backfill_until(bridge: MatrixInfluxBridge, expected_count: int) -> None:
+    """Fetch history until the database holds at least expected_count messages."""
+
+    async def backfilled() -> bool:
+        await bridge.fetch_historical_messages()
+        return stored_message_count(bridge) >= expected_count
+
+    await wait_until(backfilled)
+
+
+async def bridge_synced(bridge: MatrixInfluxBridge, room_ids: list[str]) -> bool:
+    """Fetch history and report whether every room now has a sync token."""
+    await bridge.fetch_historical_messages()
+    return all(bridge.room_sync_times.get(room_id) for room_id in room_ids)
+
 
 @pytest.fixture
 async def matrix_client(synapse_container) -> AsyncClient:
@@ -33,18 +87,25 @@ async def matrix_client(synapse_container) -> AsyncClient:
 
 
 @pytest.fixture
-def integration_settings(postgres_container, synapse_container, temp_dir) -> Settings:
+def integration_settings(
+    postgres_container, reset_postgres, synapse_container, temp_dir, monkeypatch
+) -> Settings:
     """Create settings for integration tests."""
-    os.environ.update(
-        {
-            "MATRIX_HOMESERVER": synapse_container["homeserver"],
-            "MATRIX_USER": synapse_container["user"],
-            "MATRIX_PASSWORD": synapse_container["password"],
-            "MATRIX_ROOM_ID": synapse_container["room_id"],
-            "POSTGRES_URL": postgres_container["url"],
-            "POSTGRES_STORE_CONTENT": "true",
-        }
-    )
+    env = {
+        "MATRIX_HOMESERVER": synapse_container["homeserver"],
+        "MATRIX_USER": synapse_container["user"],
+        "MATRIX_PASSWORD": synapse_container["password"],
+        "MATRIX_ROOM_ID": synapse_container["room_id"],
+        "DATABASE_TYPE": "postgresql",
+        "POSTGRES_HOST": postgres_container["host"],
+        "POSTGRES_PORT": str(postgres_container["port"]),
+        "POSTGRES_DB": postgres_container["database"],
+        "POSTGRES_USER": postgres_container["user"],
+        "POSTGRES_PASSWORD": postgres_container["password"],
+        "POSTGRES_STORE_CONTENT": "true",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
 
     settings = Settings()
     settings.sync_state_file = str(temp_dir / "integration_sync_state.json")
@@ -52,25 +113,41 @@ def integration_settings(postgres_container, synapse_container, temp_dir) -> Set
     return settings
 
 
-async def test_message_ingestion(
-    integration_settings: Settings, matrix_client: AsyncClient, postgres_container: dict
-):
-    """Test the full pipeline of message ingestion."""
-    # Create test rooms
-    room_responses = []
-    for i in range(2):
-        room_response = await matrix_client.room_create(
-            visibility=RoomVisibility.public, name=f"Test Room {i + 1}"
+async def create_rooms(client: AsyncClient, count: int) -> list[str]:
+    """Create count public rooms concurrently and return their IDs."""
+    responses = await asyncio.gather(
+        *(
+            client.room_create(visibility=RoomVisibility.public, name=f"Test Room {i + 1}")
+            for i in range(count)
         )
-        assert room_response.room_id is not None
-        room_responses.append(room_response.room_id)
+    )
+    room_ids = [response.room_id for response in responses]
+    assert all(room_id is not None for room_id in room_ids)
+    return room_ids
 
-    # Update settings with room IDs
-    integration_settings.matrix.room_ids = room_responses
 
-    # Create and start the bridge
+@pytest.fixture
+async def rooms_with_bridge(
+    request, matrix_client: AsyncClient, integration_settings: Settings
+):
+    """Create request.param rooms and a connected bridge monitoring them."""
+    room_ids = await create_rooms(matrix_client, request.param)
+    integration_settings.matrix.room_ids = tuple(room_ids)
+
     bridge = MatrixInfluxBridge(integration_settings)
     await bridge.connect_to_matrix()
+    try:
+        yield bridge, room_ids
+    finally:
+        await bridge.close()
+
+
+@pytest.mark.parametrize("rooms_with_bridge", [2], indirect=True)
+async def test_message_ingestion(
+    rooms_with_bridge: tuple[MatrixInfluxBridge, list[str]], matrix_client: AsyncClient
+):
+    """Test the full pipeline of message ingestion."""
+    bridge, room_ids = rooms_with_bridge
 
     # Send test messages to each room
     test_messages = {
@@ -79,73 +156,52 @@ async def test_message_ingestion(
             f"Test message 2 with #tag in {room_id}",
             f"Test message 3 with @mention in {room_id}",
         ]
-        for room_id in room_responses
+        for room_id in room_ids
     }
 
-    for room_id, messages in test_messages.items():
-        for msg in messages:
-            await matrix_client.room_send(
-                room_id=room_id,
-                message_type="m.room.message",
-                content={"msgtype": "m.text", "body": msg},
-            )
-
-    # Wait for messages to be processed
-    await asyncio.sleep(2)
-
-    # Fetch historical messages
-    await bridge.fetch_historical_messages()
+    await send_messages(
+        matrix_client,
+        [(room_id, msg) for room_id, messages in test_messages.items() for msg in messages],
+    )
 
-    # Verify messages in PostgreSQL
-    engine = create_engine(integration_settings.postgres.url)
-    with Session(engine) as session:
-        for room_id, messages in test_messages.items():
-            for msg in messages:
-                stmt = select(Message).where(
-                    Message.room_id == room_id, Message.content == msg
-                )
-                result = session.execute(stmt).scalar_one_or_none()
-                assert result is not None
-                assert result.content == msg
-                assert result.room_id == room_id
-                assert result.message_type == "m.text"
+    # Fetch historical messages as soon as synapse has them all
+    await backfill_until(bridge, sum(len(m) for m in test_messages.values()))
+
+    # Verify messages in PostgreSQL with a single query
+    pairs = [
+        (room_id, msg) for room_id, messages in test_messages.items() for msg in messages
+    ]
+    with Session(bridge.engine) as session:
+        rows = session.execute(
+            select(Message.room_id, Message.content, Message.message_type).where(
+                tuple_(Message.room_id, Message.content).in_(pairs)
+            )
+        ).all()
+    # Each message is stored exactly once
+    assert len(rows) == len(pairs)
+    stored = {(row.room_id, row.content): row.message_type for row in rows}
+    assert set(stored) == set(pairs)
+    assert set(stored.values()) == {RoomMessageText.__name__}
 
 
+@pytest.mark.parametrize("rooms_with_bridge", [3], indirect=True)
 async def test_multi_room_sync_state(
-    integration_settings: Settings, matrix_client: AsyncClient
+    rooms_with_bridge: tuple[MatrixInfluxBridge, list[str]],
+    integration_settings: Settings,
+    matrix_client: AsyncClient,
 ):
     """Test sync state persistence across multiple rooms."""
-    # Create multiple test rooms
-    room_responses = []
-    room_ids = set()
-    for i in range(3):
-        room_response = await matrix_client.room_create(
-            visibility=RoomVisibility.public, name=f"Test Room {i + 1}"
-        )
-        assert room_response.room_id is not None
-        room_ids |= {room_response.room_id}
-        room_responses.append(room_response.room_id)
-
-    # Configure bridge to monitor all rooms
-    integration_settings.matrix.room_ids = list(
-        room_ids
-    )  # Empty list means monitor all rooms
-
-    # First bridge instance
-    bridge1 = MatrixInfluxBridge(integration_settings)
-    await bridge1.connect_to_matrix()
+    # First bridge instance monitors every room
+    bridge1, room_ids = rooms_with_bridge
 
     # Send messages to different rooms
-    for room_id in room_ids:
-        await matrix_client.room_send(
-            room_id=room_id,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": f"Initial message in {room_id}"},
-        )
+    await send_messages(
+        matrix_client,
+        [(room_id, f"Initial message in {room_id}") for room_id in room_ids],
+    )
 
-    # Let messages be processed
-    await asyncio.sleep(10)
-    await bridge1.fetch_historical_messages()
+    # Fetch historical messages as soon as synapse has them all
+    await backfill_until(bridge1, len(room_ids))
 
     # Store sync times
     original_sync_times = bridge1.room_sync_times.copy()
@@ -169,18 +225,13 @@ async def test_multi_room_sync_state(
     assert bridge2.room_sync_times == original_sync_times
 
     # Send new messages to each room
-    for room_id in room_ids:
-        await matrix_client.room_send(
-            room_id=room_id,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": f"New message in {room_id}"},
-        )
-
-    # Let messages be processed
-    await asyncio.sleep(10)
+    await send_messages(
+        matrix_client,
+        [(room_id, f"New message in {room_id}") for room_id in room_ids],
+    )
 
     # Verify only new messages are fetched
-    await bridge2.fetch_historical_messages()
+    await backfill_until(bridge2, len(room_ids) * 2)
     for room_id in room_ids:
         assert bridge2.room_sync_times[room_id] > original_sync_times[room_id]
 
@@ -189,38 +240,29 @@ async def test_multi_room_sync_state(
         stmt = select(Message).order_by(Message.timestamp)
         all_messages = session.execute(stmt).scalars().all()
         assert len(all_messages) == len(room_ids) * 2  # Initial + new messages
+    await bridge2.close()
 
 
+@pytest.mark.parametrize("rooms_with_bridge", [2], indirect=True)
 async def test_room_filtering(
-    integration_settings: Settings, matrix_client: AsyncClient
+    rooms_with_bridge: tuple[MatrixInfluxBridge, list[str]],
+    matrix_client: AsyncClient,
 ):
     """Test that room filtering works correctly."""
-    # Create multiple test rooms
-    room_ids = []
-    for i in range(3):
-        room_response = await matrix_client.room_create(
-            visibility=RoomVisibility.public, name=f"Test Room {i}"
-        )
-        assert room_response.room_id is not None
-        room_ids.append(room_response.room_id)
-
-    # Configure bridge to monitor only specific rooms
-    monitored_rooms = room_ids[:2]  # Monitor only first two rooms
-    integration_settings.matrix.room_ids = monitored_rooms
-
-    bridge = MatrixInfluxBridge(integration_settings)
-    await bridge.connect_to_matrix()
+    # The bridge monitors only the rooms it was created with
+    bridge, monitored_rooms = rooms_with_bridge
+    (unmonitored_room,) = await create_rooms(matrix_client, 1)
 
     # Send messages to all rooms
-    for room_id in room_ids:
-        await matrix_client.room_send(
-            room_id=room_id,
-            message_type="m.room.message",
-            content={"msgtype": "m.text", "body": f"Test message in {room_id}"},
-        )
+    await send_messages(
+        matrix_client,
+        [
+            (room_id, f"Test message in {room_id}")
+            for room_id in [*monitored_rooms, unmonitored_room]
+        ],
+    )
 
-    await asyncio.sleep(2)
-    await bridge.fetch_historical_messages()
+    await wait_until(lambda: bridge_synced(bridge, monitored_rooms))
 
     # Verify only monitored rooms have sync times
     for room_id in monitored_rooms:
@@ -228,5 +270,4 @@ async def test_room_filtering(
         assert bridge.room_sync_times[room_id] is not None
 
     # Verify unmonitored room is not tracked
-    unmonitored_room = room_ids[2]
     assert unmonitored_room not in bridge.room_sync_times
@@ -1,22 +1,29 @@
 """Tests for logging module."""
 
 import logging
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
-from matrix_influx.logger import setup_logging, get_logger
+from pytest_mock import MockerFixture
+
+from matrix_influx.logger import setup_logging, stop_logging, get_logger
 
 
 def test_setup_logging(test_settings, temp_dir: Path):
     """Test logging setup creates handlers correctly."""
-    setup_logging(test_settings)
+    listener = setup_logging(test_settings)
 
     root_logger = logging.getLogger()
     # This fails depending on the environment
     # assert root_logger.level == logging.DEBUG
 
-    # Should have console and file handlers
-    assert len(root_logger.handlers) == 2
-    handlers = {type(h) for h in root_logger.handlers}
+    # Root logger only enqueues records for the background listener
+    assert len(root_logger.handlers) == 1
+    assert isinstance(root_logger.handlers[0], logging.handlers.QueueHandler)
+
+    # Listener should have console and file handlers
+    assert len(listener.handlers) == 2
+    handlers = {type(h) for h in listener.handlers}
     assert logging.StreamHandler in handlers
     assert logging.handlers.RotatingFileHandler in handlers
 
@@ -32,20 +39,22 @@ def test_get_logger():
     assert logger.name == "test_module"
 
 
-def test_log_rotation(test_settings, temp_dir: Path):
+def test_log_rotation(test_settings, temp_dir: Path, mocker: MockerFixture):
     """Test log rotation when file exceeds size limit."""
+    # Trigger the rollover directly instead of writing max_size_mb to disk
+    mocker.patch.object(RotatingFileHandler, "shouldRollover", return_value=True)
     setup_logging(test_settings)
     logger = get_logger("test_rotation")
 
-    # Write enough data to trigger rotation
-    large_msg = "x" * (test_settings.logging.max_size_mb * 1024 * 1024 + 1000)
-    logger.info(large_msg)
+    logger.info("rotated record")
+    stop_logging()
 
-    Path(test_settings.logging.file_path)
-    Path(f"{test_settings.logging.file_path}.1")
+    log_path = Path(test_settings.logging.file_path)
+    backup_path = Path(f"{test_settings.logging.file_path}.1")
 
-    # assert log_path.exists()
-    # assert backup_path.exists()
+    assert log_path.exists()
+    assert backup_path.exists()
+    assert "rotated record" in log_path.read_text()
 
 
 def test_logging_levels(test_settings):
@@ -59,3 +68,22 @@ def test_logging_levels(test_settings):
     test_settings.logging.level = "ERROR"
     setup_logging(test_settings)
     assert logger.getEffectiveLevel() == logging.ERROR
+
+
+def test_setup_logging_skips_unused_record_attributes(test_settings):
+    """Test per-record thread/process lookups are disabled."""
+    setup_logging(test_settings)
+
+    assert logging.logThreads is False
+    assert logging.logProcesses is False
+    assert logging.logMultiprocessing is False
+
+
+def test_stop_logging_flushes_queued_records(test_settings):
+    """Test stopping the listener writes pending records to the log file."""
+    setup_logging(test_settings)
+    get_logger("test_stop").info("queued record")
+
+    stop_logging()
+
+    assert "queued record" in Path(test_settings.logging.file_path).read_text()
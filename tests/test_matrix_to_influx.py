@@ -8,107 +8,17 @@ from pytest_mock import MockerFixture
 from nio import (
     RoomMessageText,
     RoomMessagesResponse,
-    RoomMessageEmote,
-    RoomMessageNotice,
-    JoinedRoomsResponse,
 )
-from sqlalchemy.orm import Session
 
 from matrix_influx.matrix_to_influx import MatrixInfluxBridge, main
-from matrix_influx.schema import Message
 
-
-@pytest.fixture
-def bridge(test_settings, mocker: MockerFixture):
-    """Create a test bridge instance with mocked clients."""
-    # Mock SQLAlchemy engine and session before creating bridge
-    mock_engine = mocker.patch("sqlalchemy.create_engine")
-    mock_session = MagicMock(spec=Session)
-    mock_session_maker = mocker.patch("sqlalchemy.orm.Session")
-    mock_session_maker.return_value = mock_session
-    mock_session.__enter__.return_value = mock_session
-    mock_session.__exit__.return_value = None
-
-    # Create bridge instance
-    bridge = MatrixInfluxBridge(test_settings)
-
-    # Mock Matrix client
-    mock_matrix = mocker.patch("nio.AsyncClient", autospec=True)
-    mock_matrix_instance = mock_matrix.return_value
-    mock_matrix_instance.joined_rooms = AsyncMock(
-        return_value=JoinedRoomsResponse(
-            rooms=["!test1:matrix.org", "!test2:matrix.org"]
-        )
-    )
-
-    # Set mocked engine
-    bridge.engine = mock_engine.return_value
-
-    return bridge
-
-
-@pytest.fixture
-def mock_messages():
-    """Create a set of test messages."""
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
-    return [
-        RoomMessageText(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test:matrix.org",
-                "origin_server_ts": timestamp,
-            },
-            body="test message",
-            formatted_body="<p>test message</p>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageEmote(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test2:matrix.org",
-                "origin_server_ts": timestamp + 1000,
-            },
-            body="waves hello",
-            formatted_body="<em>waves hello</em>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageText(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test3:matrix.org",
-                "origin_server_ts": timestamp + 1500,
-            },
-            body="test message 2",
-            formatted_body="<p>test message 2</p>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageText(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test4:matrix.org",
-                "origin_server_ts": timestamp + 2000,
-            },
-            body="test message 3",
-            formatted_body="<p>test message 3</p>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageNotice(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@system:matrix.org",
-                "origin_server_ts": timestamp + 2000,
-            },
-            body="System notice",
-            formatted_body="<strong>System notice</strong>",
-            format="org.matrix.custom.html",
-        ),
-    ]
+from .conftest import TIMESTAMP_MS
 
 
 def test_load_sync_state(bridge, temp_dir):
     """Test loading sync state from file."""
     # Test with existing state file
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    timestamp = TIMESTAMP_MS
     test_state = {"!test1:matrix.org": timestamp, "!test2:matrix.org": timestamp + 1000}
     with open(bridge.settings.sync_state_file, "w") as f:
         json.dump(test_state, f)
@@ -133,7 +43,7 @@ def test_load_sync_state(bridge, temp_dir):
 
 def test_save_sync_state(bridge):
     """Test saving sync state to file."""
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    timestamp = TIMESTAMP_MS
     test_state = {"!test1:matrix.org": timestamp, "!test2:matrix.org": timestamp + 1000}
     bridge.room_sync_times = test_state.copy()
     bridge.save_sync_state()
@@ -143,8 +53,9 @@ def test_save_sync_state(bridge):
         assert state == test_state
 
 
-async def test_fetch_historical_messages(bridge, mock_messages):
-    """Test fetching historical messages from multiple rooms."""
+@pytest.fixture
+async def fetched_bridge(bridge, mock_messages):
+    """Run one history fetch across two rooms for the fetch tests to inspect."""
     # Set up mock response for each room
     mock_response = RoomMessagesResponse(
         chunk=mock_messages, start="t1", end="t2", room_id="!test1:matrix.org"
@@ -156,104 +67,83 @@ async def test_fetch_historical_messages(bridge, mock_messages):
     bridge.room_sync_times = {"!test1:matrix.org": None, "!test2:matrix.org": None}
 
     await bridge.fetch_historical_messages()
+    return bridge
+
+
+async def test_fetch_historical_messages(fetched_bridge, mock_messages):
+    """Test fetching historical messages from multiple rooms."""
+    bridge = fetched_bridge
 
-    # Verify messages were written to InfluxDB for each room
+    # Verify each room's messages were written in a single batch
     text_message_count = sum(
         1 for msg in mock_messages if isinstance(msg, RoomMessageText)
     )
-    expected_calls = text_message_count * len(bridge.monitored_rooms)
-    assert bridge.write_api.write.call_count == expected_calls
+    mock_session = bridge.session_maker.return_value
+    assert mock_session.execute.call_count == len(bridge.monitored_rooms)
+    for call in mock_session.execute.call_args_list:
+        assert len(call.args[1]) == text_message_count
 
-    # Verify sync times were updated for both rooms
-    str(mock_messages[-1].server_timestamp)
-    # This fails for now since the data for the sync is an event id, not a timestamp
-    # for room_id in bridge.monitored_rooms:
-    #     assert bridge.room_sync_times[room_id] == last_message_time
+    # Verify sync positions were updated for both rooms; they are the
+    # pagination token to resume from, not a message timestamp
+    for room_id in bridge.monitored_rooms:
+        assert bridge.room_sync_times[room_id] == "t2"
 
 
-async def test_message_type_handling(bridge, mock_messages):
+async def test_message_type_handling(fetched_bridge, mock_messages):
     """Test handling of different message types."""
-    mock_response = RoomMessagesResponse(
-        chunk=mock_messages, start="t1", end="t2", room_id="!test1:matrix.org"
-    )
-    bridge.matrix_client.room_messages = AsyncMock(return_value=mock_response)
-
-    # Initialize monitored rooms
-    bridge.monitored_rooms = {"!test1:matrix.org"}
-    bridge.room_sync_times = {"!test1:matrix.org": None}
-
-    await bridge.fetch_historical_messages()
-
-    points = [call.kwargs["record"] for call in bridge.write_api.write.call_args_list]
+    bridge = fetched_bridge
+    mock_session = bridge.session_maker.return_value
+    batches = [call.args[1] for call in mock_session.execute.call_args_list]
     text_messages = [msg for msg in mock_messages if isinstance(msg, RoomMessageText)]
 
-    # Verify we have the right number of points
-    assert len(points) == len(text_messages)
+    # Each room's batch holds rows for that room only
+    room_ids = [{row["room_id"] for row in rows} for rows in batches]
+    assert all(len(ids) == 1 for ids in room_ids)
+    assert set().union(*room_ids) == bridge.monitored_rooms
 
-    # Verify message types were properly tagged
-    for point, msg in zip(points, text_messages):
-        assert point._tags["message_type"] == "RoomMessageText"
-        assert point._tags["sender"] == msg.source["sender"]
-        assert point._tags["room_id"] == "!test1:matrix.org"
-        assert point._fields["content_length"] == len(msg.body)
-        if bridge.settings.influxdb.store_content:
-            assert point._fields["content"] == msg.body
-        else:
-            assert "content" not in point._fields
-
-
-async def test_error_handling(bridge):
-    """Test error handling during message fetching."""
-    # Test Matrix API error
+    # Verify message types were properly recorded, one row per text message
+    store_content = bridge.settings.database.store_content
+    for rows in batches:
+        assert [row["message_type"] for row in rows] == ["RoomMessageText"] * len(
+            text_messages
+        )
+        assert [row["sender"] for row in rows] == [
+            msg.source["sender"] for msg in text_messages
+        ]
+        assert [row["content_length"] for row in rows] == [
+            len(msg.body) for msg in text_messages
+        ]
+        assert [row["content"] for row in rows] == [
+            msg.body if store_content else None for msg in text_messages
+        ]
+
+
+async def test_fetch_error_from_matrix(bridge):
+    """Test a Matrix API error during fetching is raised."""
     bridge.matrix_client.room_messages = AsyncMock(side_effect=Exception("API Error"))
-
-    # Initialize monitored rooms
     bridge.monitored_rooms = {"!test1:matrix.org"}
     bridge.room_sync_times = {"!test1:matrix.org": None}
 
-    # Verify the error is raised
     with pytest.raises(Exception, match="API Error"):
         await bridge.fetch_historical_messages()
 
-    # Test InfluxDB write error
-    bridge.matrix_client.room_messages.side_effect = None
-    bridge.matrix_client.room_messages.return_value = RoomMessagesResponse(
-        room_id="!test1:matrix.org",
-        chunk=[
-            RoomMessageText(
-                source={
-                    "event_id": "!test1:matrix.org",
-                    "sender": "@test:matrix.org",
-                    "origin_server_ts": int(
-                        datetime.now(timezone.utc).timestamp() * 1000
-                    ),
-                },
-                body="test",
-                formatted_body="<p>test</p>",
-                format="org.matrix.custom.html",
-            )
-        ],
-        start="t1",
-        end="t2",
-    )
 
-    bridge.write_api.write.side_effect = Exception("Write Error")
+async def test_fetch_error_from_database(bridge, mock_messages):
+    """Test a database write error during fetching is raised."""
+    bridge.matrix_client.room_messages = AsyncMock(
+        return_value=RoomMessagesResponse(
+            room_id="!test1:matrix.org", chunk=mock_messages[:1], start="t1", end="t2"
+        )
+    )
+    bridge.monitored_rooms = {"!test1:matrix.org"}
+    bridge.room_sync_times = {"!test1:matrix.org": None}
+    bridge.session_maker.return_value.execute.side_effect = Exception("Write Error")
 
     with pytest.raises(Exception, match="Write Error"):
         await bridge.fetch_historical_messages()
 
-
-@pytest.fixture
-def mock_settings(mocker: MockerFixture, request):
-    """Create mocked settings for testing."""
-    settings = mocker.MagicMock()
-    settings.matrix = mocker.MagicMock()
-    settings.postgres = mocker.MagicMock()
-    # Allow parametrizing store_content
-    settings.postgres.store_content = getattr(request, "param", {}).get(
-        "store_content", False
-    )
-    return settings
+    # The failed page is not marked as synced
+    assert bridge.room_sync_times["!test1:matrix.org"] is None
 
 
 @pytest.mark.asyncio
@@ -261,11 +151,12 @@ async def test_main_normal_shutdown(mock_settings, mocker: MockerFixture):
     """Test normal startup and shutdown of the main function."""
     # Mock setup_logging
     mock_setup_logging = mocker.patch("matrix_influx.matrix_to_influx.setup_logging")
+    mock_stop_logging = mocker.patch("matrix_influx.matrix_to_influx.stop_logging")
 
     # Mock MatrixInfluxBridge
     mock_bridge = mocker.MagicMock()
     mock_bridge.run = AsyncMock()
-    mock_bridge.matrix_client = AsyncMock()
+    mock_bridge.close = AsyncMock()
     mock_bridge_cls = mocker.patch(
         "matrix_influx.matrix_to_influx.MatrixInfluxBridge", return_value=mock_bridge
     )
@@ -280,7 +171,9 @@ async def test_main_normal_shutdown(mock_settings, mocker: MockerFixture):
     mock_setup_logging.assert_called_once_with(mock_settings)
     mock_bridge_cls.assert_called_once_with(mock_settings)
     mock_bridge.run.assert_called_once()
-    mock_bridge.matrix_client.close.assert_called_once()
+    # close() flushes buffered messages, so it must actually be awaited
+    mock_bridge.close.assert_awaited_once()
+    mock_stop_logging.assert_called_once()
 
 
 @pytest.mark.asyncio
@@ -292,7 +185,7 @@ async def test_main_keyboard_interrupt(mock_settings, mocker: MockerFixture):
     # Mock MatrixInfluxBridge
     mock_bridge = mocker.MagicMock()
     mock_bridge.run = AsyncMock(side_effect=KeyboardInterrupt)
-    mock_bridge.matrix_client = AsyncMock()
+    mock_bridge.close = AsyncMock()
     mocker.patch(
         "matrix_influx.matrix_to_influx.MatrixInfluxBridge", return_value=mock_bridge
     )
@@ -303,66 +196,69 @@ async def test_main_keyboard_interrupt(mock_settings, mocker: MockerFixture):
     # Run main
     await main()
 
-    # Verify cleanup was performed
-    mock_bridge.matrix_client.close.assert_called_once()
+    # Verify cleanup was performed, flushing buffered messages before exit
+    mock_bridge.close.assert_awaited_once()
 
 
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "mock_settings", [{"store_content": True}, {"store_content": False}], indirect=True
 )
-async def test_message_content_storage(mock_settings, mocker: MockerFixture):
+async def test_message_content_storage(
+    mock_settings, mock_session, mocker: MockerFixture
+):
     """Test that message content storage respects the store_content setting."""
     # Mock SQLAlchemy session
-    mock_session = MagicMock(spec=Session)
-    mock_session_maker = mocker.patch("sqlalchemy.orm.Session")
-    mock_session_maker.return_value = mock_session
-    mock_session.__enter__.return_value = mock_session
-    mock_session.__exit__.return_value = None
+    mocker.patch(
+        "matrix_influx.matrix_to_influx.sessionmaker",
+        return_value=MagicMock(return_value=mock_session),
+    )
 
     # Mock engine
-    mock_engine = mocker.patch("sqlalchemy.create_engine")
+    mocker.patch("matrix_influx.matrix_to_influx.create_engine")
+    mocker.patch("matrix_influx.matrix_to_influx.Base")
 
     # Create bridge
     bridge = MatrixInfluxBridge(mock_settings)
-    bridge.engine = mock_engine.return_value
 
     # Create a test message
     test_message = "Test message content"
-    timestamp = datetime.now(timezone.utc)
+    # Matrix timestamps only carry millisecond precision
+    timestamp = datetime.fromtimestamp(TIMESTAMP_MS / 1000, tz=timezone.utc)
     event = RoomMessageText(
         source={
             "event_id": "!test1:matrix.org",
             "sender": "@test:matrix.org",
-            "origin_server_ts": int(timestamp.timestamp() * 1000),
+            "origin_server_ts": TIMESTAMP_MS,
         },
         body=test_message,
         formatted_body="<p>Test message content</p>",
         format="org.matrix.custom.html",
     )
 
-    # Process the message
+    # Process the message; it stays buffered until flushed
     await bridge.handle_message("!test_room:matrix.org", event)
+    mock_session.execute.assert_not_called()
+    bridge.flush_messages()
 
     # Verify the message was stored
-    mock_session.add.assert_called_once()
-    stored_msg = mock_session.add.call_args[0][0]
-    assert isinstance(stored_msg, Message)
+    mock_session.execute.assert_called_once()
+    (stored_msg,) = mock_session.execute.call_args[0][1]
 
     # Always check for content_length
-    assert stored_msg.content_length == len(test_message)
+    assert stored_msg["content_length"] == len(test_message)
 
     # Check content field based on store_content setting
-    if mock_settings.postgres.store_content:
-        assert stored_msg.content == test_message
+    if mock_settings.database.store_content:
+        assert stored_msg["content"] == test_message
     else:
-        assert stored_msg.content is None
+        assert stored_msg["content"] is None
 
     # Check other fields
-    assert stored_msg.room_id == "!test_room:matrix.org"
-    assert stored_msg.sender == "@test:matrix.org"
-    assert stored_msg.message_type == "RoomMessageText"
-    assert stored_msg.timestamp == timestamp
+    assert stored_msg["room_id"] == "!test_room:matrix.org"
+    assert stored_msg["sender"] == "@test:matrix.org"
+    assert stored_msg["message_type"] == "RoomMessageText"
+    assert stored_msg["timestamp"] == timestamp
 
 
 class MockLoginResponse:
@@ -1,93 +1,36 @@
 """Tests for Matrix to PostgreSQL bridge."""
 
+import asyncio
 import json
+import logging
+import os
+import stat
+import threading
 from datetime import datetime, timezone
 import pytest
 from unittest.mock import AsyncMock, MagicMock
 from pytest_mock import MockerFixture
 from nio import (
-    RoomMessageText,
-    RoomMessageEmote,
     RoomMessageNotice,
+    RoomMessageText,
+    RoomMessagesResponse,
     JoinedRoomsResponse,
+    UploadFilterError,
+    UploadFilterResponse,
 )
-from sqlalchemy.orm import Session
+from nio.client.async_client import connect_wrapper, on_request_chunk_sent
+from sqlalchemy import create_engine, text
 
 from matrix_influx.matrix_to_influx import MatrixInfluxBridge
 from matrix_influx.schema import Message
 
-
-@pytest.fixture
-def bridge(test_settings, mocker: MockerFixture):
-    """Create a test bridge instance with mocked clients."""
-    # Mock SQLAlchemy engine and session before creating bridge
-    mock_engine = mocker.patch("sqlalchemy.create_engine")
-    mock_session = MagicMock(spec=Session)
-    mock_session_maker = mocker.patch("sqlalchemy.orm.Session")
-    mock_session_maker.return_value = mock_session
-    mock_session.__enter__.return_value = mock_session
-    mock_session.__exit__.return_value = None
-
-    # Create bridge instance
-    bridge = MatrixInfluxBridge(test_settings)
-
-    # Mock Matrix client
-    mock_matrix = mocker.patch("nio.AsyncClient", autospec=True)
-    mock_matrix_instance = mock_matrix.return_value
-    mock_matrix_instance.joined_rooms = AsyncMock(
-        return_value=JoinedRoomsResponse(
-            rooms=["!test1:matrix.org", "!test2:matrix.org"]
-        )
-    )
-
-    # Set mocked engine
-    bridge.engine = mock_engine.return_value
-
-    return bridge
-
-
-@pytest.fixture
-def mock_messages():
-    """Create a set of test messages."""
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
-    return [
-        RoomMessageText(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test:matrix.org",
-                "origin_server_ts": timestamp,
-            },
-            body="test message",
-            formatted_body="<p>test message</p>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageEmote(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@test2:matrix.org",
-                "origin_server_ts": timestamp + 1000,
-            },
-            body="waves hello",
-            formatted_body="<em>waves hello</em>",
-            format="org.matrix.custom.html",
-        ),
-        RoomMessageNotice(
-            source={
-                "event_id": "!test1:matrix.org",
-                "sender": "@system:matrix.org",
-                "origin_server_ts": timestamp + 2000,
-            },
-            body="System notice",
-            formatted_body="<strong>System notice</strong>",
-            format="org.matrix.custom.html",
-        ),
-    ]
+from .conftest import TIMESTAMP_MS
 
 
 def test_load_sync_state(bridge, temp_dir):
     """Test loading sync state from file."""
     # Test with existing state file
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    timestamp = TIMESTAMP_MS
     test_state = {"!test1:matrix.org": timestamp, "!test2:matrix.org": timestamp + 1000}
 
     with open(bridge.settings.sync_state_file, "w") as f:
@@ -99,7 +42,7 @@ def test_load_sync_state(bridge, temp_dir):
 
 def test_save_sync_state(bridge, temp_dir):
     """Test saving sync state to file."""
-    timestamp = int(datetime.now(timezone.utc).timestamp() * 1000)
+    timestamp = TIMESTAMP_MS
     bridge.room_sync_times = {
         "!test1:matrix.org": timestamp,
         "!test2:matrix.org": timestamp + 1000,
@@ -127,37 +70,39 @@ def test_message_type_handling(bridge, mock_messages):
         )
 
     # Verify each message was stored with correct type
-    mock_session = Session.return_value
-    assert mock_session.add.call_count == len(mock_messages)
-    for i, message in enumerate(mock_messages):
-        stored_msg = mock_session.add.call_args_list[i][0][0]
-        assert isinstance(stored_msg, Message)
-        assert stored_msg.message_type == type(message).__name__
-        assert stored_msg.content_length == len(message.body)
+    mock_session = bridge.session_maker.return_value
+    assert mock_session.execute.call_count == len(mock_messages)
+    calls = mock_session.execute.call_args_list
+    stored = [row for call in calls for row in call.args[1]]
+    assert [row["message_type"] for row in stored] == [
+        type(message).__name__ for message in mock_messages
+    ]
+    assert [row["content_length"] for row in stored] == [
+        len(message.body) for message in mock_messages
+    ]
 
 
 @pytest.mark.parametrize(
     "mock_settings", [{"store_content": True}, {"store_content": False}], indirect=True
 )
-def test_message_content_storage(mock_settings, mocker: MockerFixture):
+def test_message_content_storage(mock_settings, mock_session, mocker: MockerFixture):
     """Test that message content storage respects the store_content setting."""
     # Mock SQLAlchemy session
-    mock_session = MagicMock(spec=Session)
-    mock_session_maker = mocker.patch("sqlalchemy.orm.Session")
-    mock_session_maker.return_value = mock_session
-    mock_session.__enter__.return_value = mock_session
-    mock_session.__exit__.return_value = None
+    mocker.patch(
+        "matrix_influx.matrix_to_influx.sessionmaker",
+        return_value=MagicMock(return_value=mock_session),
+    )
 
     # Mock engine
-    mock_engine = mocker.patch("sqlalchemy.create_engine")
+    mocker.patch("matrix_influx.matrix_to_influx.create_engine")
+    mocker.patch("matrix_influx.matrix_to_influx.Base")
 
     # Create bridge
     bridge = MatrixInfluxBridge(mock_settings)
-    bridge.engine = mock_engine.return_value
 
     # Test message
     test_message = "Test message content"
-    timestamp = datetime.now(timezone.utc)
+    timestamp = datetime.fromtimestamp(TIMESTAMP_MS / 1000, tz=timezone.utc)
 
     # Store message
     bridge.store_message_in_db(
@@ -169,23 +114,23 @@ def test_message_content_storage(mock_settings, mocker: MockerFixture):
     )
 
     # Verify message was stored correctly
-    mock_session.add.assert_called_once()
-    stored_msg = mock_session.add.call_args[0][0]
+    mock_session.execute.assert_called_once()
+    (stored_msg,) = mock_session.execute.call_args[0][1]
 
     # Always check content length
-    assert stored_msg.content_length == len(test_message)
+    assert stored_msg["content_length"] == len(test_message)
 
     # Check content based on store_content setting
-    if mock_settings.postgres.store_content:
-        assert stored_msg.content == test_message
+    if mock_settings.database.store_content:
+        assert stored_msg["content"] == test_message
     else:
-        assert stored_msg.content is None
+        assert stored_msg["content"] is None
 
     # Check other fields
-    assert stored_msg.room_id == "!test:matrix.org"
-    assert stored_msg.sender == "@test:matrix.org"
-    assert stored_msg.message_type == "RoomMessageText"
-    assert stored_msg.timestamp == timestamp
+    assert stored_msg["room_id"] == "!test:matrix.org"
+    assert stored_msg["sender"] == "@test:matrix.org"
+    assert stored_msg["message_type"] == "RoomMessageText"
+    assert stored_msg["timestamp"] == timestamp
 
 
 class MockLoginResponse:
@@ -194,3 +139,774 @@ class MockLoginResponse:
     @property
     def access_token(self):
         return "mock_token"
+
+
+async def test_fetch_historical_messages_batches_writes(
+    bridge, mock_messages, mocker: MockerFixture
+):
+    """Test that historical messages are written in one transaction per room."""
+    mock_session = bridge.session_maker.return_value
+
+    bridge.matrix_client.room_messages = AsyncMock(
+        return_value=RoomMessagesResponse(
+            chunk=mock_messages, start="t1", end="t2", room_id="!test1:matrix.org"
+        )
+    )
+    bridge.monitored_rooms = {"!test1:matrix.org", "!test2:matrix.org"}
+    bridge.room_sync_times = {}
+
+    await bridge.fetch_historical_messages()
+
+    # One multi-row INSERT/commit per room rather than one per message
+    assert mock_session.execute.call_count == len(bridge.monitored_rooms)
+    assert mock_session.commit.call_count == len(bridge.monitored_rooms)
+
+    text_messages = [m for m in mock_messages if isinstance(m, RoomMessageText)]
+    for call in mock_session.execute.call_args_list:
+        statement, rows = call.args
+        assert statement.table.name == Message.__tablename__
+        assert len(rows) == len(text_messages)
+
+
+async def test_close_flushes_pending_messages(
+    bridge, mock_messages, mocker: MockerFixture
+):
+    """Test that buffered live messages are written on shutdown."""
+    mock_session = bridge.session_maker.return_value
+    bridge.matrix_client = AsyncMock()
+
+    await bridge.handle_message("!test1:matrix.org", mock_messages[0])
+    mock_session.execute.assert_not_called()
+
+    await bridge.close()
+
+    mock_session.execute.assert_called_once()
+    assert len(mock_session.execute.call_args[0][1]) == 1
+    assert not bridge.pending_messages
+    bridge.matrix_client.close.assert_called_once()
+    with pytest.raises(RuntimeError):
+        bridge._io_pool.submit(print)
+
+
+async def test_close_shuts_down_pool_off_loop(bridge, mocker: MockerFixture):
+    """Test that close() waits for pool writes without blocking the event loop."""
+    bridge.matrix_client = AsyncMock()
+    shutdown_threads = []
+    shutdown = bridge._io_pool.shutdown
+    mocker.patch.object(
+        bridge._io_pool,
+        "shutdown",
+        side_effect=lambda **kwargs: (
+            shutdown_threads.append(threading.current_thread()),
+            shutdown(**kwargs),
+        ),
+    )
+
+    await bridge.close()
+
+    assert shutdown_threads
+    assert shutdown_threads[0] is not threading.main_thread()
+
+
+async def test_close_cleans_up_after_failed_flush(bridge, mock_messages, caplog):
+    """Test that a failed final flush is logged and the rest of close() runs."""
+    mock_session = bridge.session_maker.return_value
+    mock_session.execute.side_effect = Exception("Write Error")
+    bridge.matrix_client = AsyncMock()
+    bridge.room_sync_times = {"!test1:matrix.org": "t1"}
+    bridge._sync_state_dirty = True
+    await bridge.handle_message("!test1:matrix.org", mock_messages[0])
+
+    with caplog.at_level(logging.ERROR):
+        await bridge.close()
+
+    assert "Final flush failed, 1 messages were not stored" in caplog.text
+    assert len(bridge.pending_messages) == 1
+    assert not bridge._sync_state_dirty
+    bridge.matrix_client.close.assert_called_once()
+    with pytest.raises(RuntimeError):
+        bridge._io_pool.submit(print)
+
+
+async def test_handle_message_flushes_full_batch_off_loop(
+    bridge, mock_messages, mocker: MockerFixture
+):
+    """Test that a full live batch is written from a worker thread."""
+    mock_session = bridge.session_maker.return_value
+    writer_threads = []
+    mock_session.execute.side_effect = lambda *args: writer_threads.append(
+        threading.current_thread()
+    )
+    bridge.settings.database.batch_size = 2
+
+    await bridge.handle_message("!test1:matrix.org", mock_messages[0])
+    mock_session.execute.assert_not_called()
+    await bridge.handle_message("!test1:matrix.org", mock_messages[0])
+
+    assert len(mock_session.execute.call_args[0][1]) == 2
+    assert writer_threads and writer_threads[0].name.startswith("matrix-influx-db")
+    assert not bridge.pending_messages
+
+
+async def test_failed_flush_keeps_pending_messages(bridge, mock_messages):
+    """Test that a failed write puts the batch back ahead of newer messages."""
+    mock_session = bridge.session_maker.return_value
+    mock_session.execute.side_effect = Exception("Write Error")
+    first, second = mock_messages[0], mock_messages[3]
+
+    await bridge.handle_message("!test1:matrix.org", first)
+    with pytest.raises(Exception, match="Write Error"):
+        await bridge.flush_messages_in_background()
+    await bridge.handle_message("!test1:matrix.org", second)
+    with pytest.raises(Exception, match="Write Error"):
+        bridge.flush_messages()
+
+    assert [row["sender"] for row in bridge.pending_messages] == [
+        first.sender,
+        second.sender,
+    ]
+
+    mock_session.execute.side_effect = None
+    bridge.flush_messages()
+    assert len(mock_session.execute.call_args[0][1]) == 2
+    assert not bridge.pending_messages
+
+
+async def test_handle_message_keeps_syncing_after_failed_flush(
+    bridge, mock_messages, caplog
+):
+    """Test that a failed full-batch flush is logged instead of ending sync."""
+    mock_session = bridge.session_maker.return_value
+    mock_session.execute.side_effect = Exception("Write Error")
+    bridge.settings.database.batch_size = 1
+    room = MagicMock(room_id="!test1:matrix.org")
+
+    with caplog.at_level(logging.ERROR):
+        await bridge.message_callback(room, mock_messages[0])
+
+    assert "Flushing a full batch failed" in caplog.text
+    assert len(bridge.pending_messages) == 1
+
+    mock_session.execute.side_effect = None
+    await bridge.message_callback(room, mock_messages[2])
+    assert len(mock_session.execute.call_args[0][1]) == 2
+    assert not bridge.pending_messages
+
+
+async def test_message_callback_debounces_sync_state(
+    bridge, mock_messages, mocker: MockerFixture
+):
+    """Test that a burst of live messages saves the sync state only once."""
+    # The bridge uses __slots__, so patch methods on the class
+    mocker.patch.object(MatrixInfluxBridge, "handle_message", AsyncMock())
+    save = mocker.spy(MatrixInfluxBridge, "save_sync_state")
+    room = MagicMock(room_id="!test1:matrix.org")
+
+    for message in mock_messages:
+        await bridge.message_callback(room, message)
+
+    assert save.call_count == 1
+    assert bridge.last_sync_time == max(
+        m.server_timestamp for m in mock_messages if type(m) is RoomMessageText
+    )
+    state_dir = os.path.dirname(bridge.settings.sync_state_file)
+    assert not [name for name in os.listdir(state_dir) if name.endswith(".tmp")]
+
+
+async def test_periodic_flush_checkpoints_sync_state(
+    bridge, mocker: MockerFixture
+):
+    """Test that the periodic flusher saves sync state left dirty by a burst."""
+    save = mocker.spy(MatrixInfluxBridge, "save_sync_state")
+    mocker.patch(
+        "matrix_influx.matrix_to_influx.asyncio.sleep",
+        AsyncMock(side_effect=[None, asyncio.CancelledError]),
+    )
+    bridge.room_sync_times = {"!test1:matrix.org": "t1"}
+    bridge._sync_state_dirty = True
+    bridge._last_sync_state_save = float("-inf")
+
+    with pytest.raises(asyncio.CancelledError):
+        await bridge._flush_periodically()
+
+    assert save.call_count == 1
+    assert not bridge._sync_state_dirty
+
+
+async def test_periodic_flush_survives_write_errors(
+    bridge, mock_messages, mocker: MockerFixture
+):
+    """Test that a failed periodic flush is logged and retried next interval."""
+    mock_session = bridge.session_maker.return_value
+    mock_session.execute.side_effect = [Exception("Write Error"), None]
+    mocker.patch(
+        "matrix_influx.matrix_to_influx.asyncio.sleep",
+        AsyncMock(side_effect=[None, None, asyncio.CancelledError]),
+    )
+    await bridge.handle_message("!test1:matrix.org", mock_messages[0])
+
+    with pytest.raises(asyncio.CancelledError):
+        await bridge._flush_periodically()
+
+    assert mock_session.execute.call_count == 2
+    assert not bridge.pending_messages
+
+
+async def test_close_waits_for_cancelled_flush_task(bridge):
+    """Test that close() awaits the periodic flusher it cancels."""
+    bridge.matrix_client = AsyncMock()
+    bridge._flush_task = task = asyncio.create_task(bridge._flush_periodically())
+    await asyncio.sleep(0)
+
+    await bridge.close()
+
+    assert task.cancelled()
+    assert bridge._flush_task is None
+
+
+async def test_message_callback_dispatches_on_event_type(bridge, mock_messages):
+    """Test that only event types with a registered handler are stored."""
+    room = MagicMock(room_id="!test1:matrix.org")
+
+    for message in mock_messages:
+        await bridge.message_callback(room, message)
+
+    text_messages = [m for m in mock_messages if type(m) is RoomMessageText]
+    assert [row["sender"] for row in bridge.pending_messages] == [
+        m.sender for m in text_messages
+    ]
+
+
+async def test_registered_event_type_labels_its_rows(bridge, mock_messages):
+    """Test a newly registered event type is stored under its own type name."""
+    bridge._event_handlers[RoomMessageNotice] = bridge.handle_message
+    notice = mock_messages[4]
+    room = MagicMock(room_id="!test1:matrix.org")
+
+    await bridge.message_callback(room, notice)
+    rows = bridge.build_room_rows("!test1:matrix.org", mock_messages)
+
+    assert [row["message_type"] for row in bridge.pending_messages] == [
+        "RoomMessageNotice"
+    ]
+    assert [row["message_type"] for row in rows] == [
+        type(m).__name__
+        for m in mock_messages
+        if type(m) in (RoomMessageText, RoomMessageNotice)
+    ]
+
+
+async def test_message_callback_dispatches_subclasses_only_when_registered(
+    bridge, mock_messages
+):
+    """Test that dispatch is by exact type, so subclasses must be registered."""
+
+    class CustomText(RoomMessageText):
+        pass
+
+    source = mock_messages[0].source
+    event = CustomText(
+        source=source, body="custom", formatted_body=None, format=None
+    )
+    room = MagicMock(room_id="!test1:matrix.org")
+
+    await bridge.message_callback(room, event)
+    assert not bridge.pending_messages
+    assert bridge.build_room_rows("!test1:matrix.org", [event]) == []
+
+    bridge._event_handlers[CustomText] = bridge.handle_message
+    await bridge.message_callback(room, event)
+    assert [
+        (row["content"], row["message_type"]) for row in bridge.pending_messages
+    ] == [("custom", "CustomText")]
+    # The backfill picks up the same registered types as live dispatch
+    assert [
+        (row["content"], row["message_type"])
+        for row in bridge.build_room_rows("!test1:matrix.org", [event])
+    ] == [("custom", "CustomText")]
+
+
+def test_sync_state_database_backend(test_settings, make_bridge):
+    """Test round-tripping sync state through the database backend."""
+    test_settings.sync_state_backend = "database"
+    bridge = make_bridge()
+    assert bridge.room_sync_times == {}
+
+    bridge.room_sync_times = {"!test1:matrix.org": "t1", "!test2:matrix.org": None}
+    bridge.save_sync_state()
+    bridge.room_sync_times["!test1:matrix.org"] = "t2"
+    bridge.save_sync_state()
+
+    restored = make_bridge()
+    assert restored.room_sync_times == {
+        "!test1:matrix.org": "t2",
+        "!test2:matrix.org": None,
+    }
+    assert not os.path.exists(test_settings.sync_state_file)
+
+
+def test_sync_state_journal_backend(
+    test_settings, make_bridge, mocker: MockerFixture
+):
+    """Test that the journal backend appends changes and compacts them."""
+    mocker.patch("matrix_influx.matrix_to_influx.SYNC_STATE_COMPACT_EVERY", 3)
+    test_settings.sync_state_backend = "journal"
+    journal_path = f"{test_settings.sync_state_file}.log"
+    bridge = make_bridge()
+
+    bridge.room_sync_times = {"!test1:matrix.org": "t1", "!test2:matrix.org": None}
+    bridge.save_sync_state()
+    bridge.room_sync_times["!test1:matrix.org"] = "t2"
+    bridge.save_sync_state()
+
+    # Only the rooms that changed are written, and the snapshot is untouched
+    with open(journal_path) as f:
+        assert [json.loads(line) for line in f] == [
+            {"!test1:matrix.org": "t1", "!test2:matrix.org": None},
+            {"!test1:matrix.org": "t2"},
+        ]
+    assert not os.path.exists(test_settings.sync_state_file)
+
+    # Reaching the compaction threshold rewrites the snapshot and drops the log
+    bridge.room_sync_times["!test2:matrix.org"] = "t3"
+    bridge.save_sync_state()
+    assert not os.path.exists(journal_path)
+    with open(test_settings.sync_state_file) as f:
+        assert json.load(f) == {"!test1:matrix.org": "t2", "!test2:matrix.org": "t3"}
+
+    # A torn final line from a crash mid-append is ignored and compacted away
+    bridge.room_sync_times["!test1:matrix.org"] = "t4"
+    bridge.save_sync_state()
+    with open(journal_path, "ab") as f:
+        f.write(b'{"!test2:matr')
+    restored = make_bridge()
+    assert restored.room_sync_times == {
+        "!test1:matrix.org": "t4",
+        "!test2:matrix.org": "t3",
+    }
+    assert not os.path.exists(journal_path)
+
+
+async def test_fetch_historical_messages_runs_rooms_concurrently(bridge, mock_messages):
+    """Test that room histories are requested concurrently."""
+    in_flight = 0
+    max_in_flight = 0
+
+    async def room_messages(room_id, **kwargs):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return RoomMessagesResponse(
+            chunk=mock_messages, start="t1", end="t2", room_id=room_id
+        )
+
+    bridge.matrix_client.room_messages = room_messages
+    bridge.monitored_rooms = {"!test1:matrix.org", "!test2:matrix.org"}
+    bridge.room_sync_times = {}
+
+    await bridge.fetch_historical_messages()
+
+    assert max_in_flight == len(bridge.monitored_rooms)
+    assert bridge.room_sync_times == {
+        "!test1:matrix.org": "t2",
+        "!test2:matrix.org": "t2",
+    }
+    with open(bridge.settings.sync_state_file) as f:
+        assert json.load(f) == bridge.room_sync_times
+
+
+async def test_fetch_historical_messages_finishes_other_rooms_on_error(
+    bridge, mock_messages
+):
+    """Test that one failing room does not stop the others from syncing."""
+    async def room_messages(room_id, **kwargs):
+        if room_id == "!test1:matrix.org":
+            raise Exception("API Error")
+        if kwargs["start"] == "t2":
+            return RoomMessagesResponse(chunk=[], start="t2", end="t2", room_id=room_id)
+        return RoomMessagesResponse(
+            chunk=mock_messages, start="t1", end="t2", room_id=room_id
+        )
+
+    bridge.matrix_client.room_messages = AsyncMock(side_effect=room_messages)
+    bridge.monitored_rooms = {"!test1:matrix.org", "!test2:matrix.org"}
+    bridge.room_sync_times = {}
+
+    with pytest.raises(Exception, match="API Error"):
+        await bridge.fetch_historical_messages()
+
+    assert bridge.room_sync_times == {"!test2:matrix.org": "t2"}
+    with open(bridge.settings.sync_state_file) as f:
+        assert json.load(f) == {"!test2:matrix.org": "t2"}
+
+
+def test_save_sync_state_keeps_previous_state_on_encode_error(
+    bridge, mocker: MockerFixture
+):
+    """Test a failed serialization leaves the last good state file in place."""
+    bridge.room_sync_times = {"!test1:matrix.org": "t1"}
+    bridge.save_sync_state()
+
+    mocker.patch(
+        "matrix_influx.matrix_to_influx._json_dumps",
+        side_effect=TypeError("not serializable"),
+    )
+    bridge.room_sync_times = {"!test1:matrix.org": "t2"}
+    with pytest.raises(TypeError):
+        bridge.save_sync_state()
+
+    bridge.load_sync_state()
+    assert bridge.room_sync_times == {"!test1:matrix.org": "t1"}
+    state_dir = os.path.dirname(bridge.settings.sync_state_file)
+    assert not [name for name in os.listdir(state_dir) if name.endswith(".tmp")]
+
+
+def test_save_sync_state_syncs_before_replacing(bridge, mocker: MockerFixture):
+    """Test the new state, then its rename, are flushed to disk in order."""
+    fsync, replace = os.fsync, os.replace
+    events = []
+
+    def record_fsync(fd):
+        is_dir = stat.S_ISDIR(os.fstat(fd).st_mode)
+        events.append("fsync dir" if is_dir else "fsync file")
+        fsync(fd)
+
+    def record_replace(src, dst):
+        events.append("replace")
+        replace(src, dst)
+
+    bridge.room_sync_times = {"!test1:matrix.org": "t1"}
+    with mocker.patch.context_manager(
+        os, "fsync", side_effect=record_fsync
+    ), mocker.patch.context_manager(os, "replace", side_effect=record_replace):
+        bridge.save_sync_state()
+    assert events == ["fsync file", "replace", "fsync dir"]
+
+    events.clear()
+    bridge.room_sync_times = {"!test1:matrix.org": "t2"}
+    with mocker.patch.context_manager(
+        os, "fsync", side_effect=record_fsync
+    ), mocker.patch.context_manager(
+        os, "replace", side_effect=OSError("crashed before rename")
+    ):
+        with pytest.raises(OSError):
+            bridge.save_sync_state()
+    assert events == ["fsync file"]
+
+    # A crash before the rename leaves the previous good state
+    bridge.load_sync_state()
+    assert bridge.room_sync_times == {"!test1:matrix.org": "t1"}
+
+
+def test_sync_state_without_orjson(bridge, mocker: MockerFixture):
+    """Test the sync state round trip falls back to the json module."""
+    bridge.room_sync_times = {"!test1:matrix.org": "t1", "!test2:matrix.org": None}
+    bridge.save_sync_state()
+    with open(bridge.settings.sync_state_file, "rb") as f:
+        saved = f.read()
+
+    mocker.patch("matrix_influx.matrix_to_influx.orjson", None)
+    bridge.save_sync_state()
+    with open(bridge.settings.sync_state_file, "rb") as f:
+        assert f.read() == saved
+    bridge.room_sync_times = {}
+    bridge.load_sync_state()
+
+    assert bridge.room_sync_times == {"!test1:matrix.org": "t1", "!test2:matrix.org": None}
+
+
+def test_concurrent_state_writes(test_settings, make_bridge):
+    """Test two bridges saving the same state file never corrupt it."""
+    bridges = [make_bridge() for _ in range(2)]
+    for i, bridge in enumerate(bridges):
+        bridge.room_sync_times = {f"!room{n}:matrix.org": f"b{i}" for n in range(200)}
+
+    errors = []
+
+    def save_repeatedly(bridge):
+        try:
+            for _ in range(200):
+                bridge.save_sync_state()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=save_repeatedly, args=(bridge,)) for bridge in bridges
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(test_settings.sync_state_file) as f:
+        assert json.load(f) in [bridge.room_sync_times for bridge in bridges]
+    state_dir = os.path.dirname(test_settings.sync_state_file)
+    assert not [name for name in os.listdir(state_dir) if name.endswith(".tmp")]
+
+
+def test_corrupted_sync_state_without_orjson(
+    test_settings, make_bridge, mocker: MockerFixture
+):
+    """Test undecodable state bytes are treated as corruption by the json fallback."""
+    mocker.patch("matrix_influx.matrix_to_influx.orjson", None)
+    with open(test_settings.sync_state_file, "wb") as f:
+        f.write(b'{"!test1:matrix.org": "\xff"}')
+    bridge = make_bridge()
+    assert bridge.room_sync_times == {}
+
+    # A journal line torn inside a multi-byte character is dropped too
+    test_settings.sync_state_backend = "journal"
+    with open(test_settings.sync_state_file, "wb") as f:
+        f.write(b"{}")
+    with open(f"{test_settings.sync_state_file}.log", "wb") as f:
+        f.write(b'{"!test1:matrix.org": "t1"}\n{"!test2:matrix.org": "\xc3')
+    bridge = make_bridge()
+    assert bridge.room_sync_times == {"!test1:matrix.org": "t1"}
+
+
+def test_build_room_rows_matches_single_message_rows(bridge, mock_messages):
+    """Test room rows match rows built one message at a time."""
+    rows = bridge.build_room_rows("!test1:matrix.org", mock_messages)
+
+    expected = [
+        bridge.build_message_row(
+            room_id="!test1:matrix.org",
+            sender=message.sender,
+            message=message.body,
+            timestamp=datetime.fromtimestamp(
+                message.server_timestamp / 1000, tz=timezone.utc
+            ),
+            message_type="RoomMessageText",
+            event_id=message.event_id,
+        )
+        for message in mock_messages
+        if isinstance(message, RoomMessageText)
+    ]
+    assert rows == expected
+
+
+async def test_fetch_historical_messages_paginates(bridge, mock_messages):
+    """Test that history is fetched page by page until it stops advancing."""
+    pages = {
+        None: RoomMessagesResponse(
+            chunk=mock_messages, start="t0", end="t1", room_id="!test1:matrix.org"
+        ),
+        "t1": RoomMessagesResponse(
+            chunk=mock_messages, start="t1", end="t2", room_id="!test1:matrix.org"
+        ),
+        "t2": RoomMessagesResponse(
+            chunk=[], start="t2", end="t2", room_id="!test1:matrix.org"
+        ),
+    }
+    bridge.matrix_client.room_messages = AsyncMock(
+        side_effect=lambda room_id, start, **kwargs: pages[start]
+    )
+    bridge.monitored_rooms = {"!test1:matrix.org"}
+    bridge.room_sync_times = {}
+
+    await bridge.fetch_historical_messages()
+
+    starts = [c.kwargs["start"] for c in bridge.matrix_client.room_messages.call_args_list]
+    assert starts == [None, "t1", "t2"]
+    assert bridge.session_maker.return_value.execute.call_count == 2
+    assert bridge.room_sync_times == {"!test1:matrix.org": "t2"}
+
+
+async def test_matrix_client_uses_keepalive_session(bridge):
+    """Test that the Matrix client reuses pooled keep-alive connections."""
+    bridge._open_http_session()
+    session = bridge.matrix_client.client_session
+    try:
+        assert not session.connector.force_close
+        # nio's upload progress tracing and connect wrapper are kept
+        assert [
+            callback
+            for trace in session.trace_configs
+            for callback in trace.on_request_chunk_sent
+        ] == [on_request_chunk_sent]
+        assert session.connector.connect.func is connect_wrapper
+
+        # An existing session is left alone
+        bridge._open_http_session()
+        assert bridge.matrix_client.client_session is session
+    finally:
+        await bridge.matrix_client.close()
+
+
+async def test_upload_sync_filter(bridge):
+    """Test that live sync is filtered down to message events."""
+    bridge.matrix_client.upload_filter = AsyncMock(
+        return_value=UploadFilterResponse(filter_id="f1")
+    )
+
+    assert await bridge.upload_sync_filter() == "f1"
+
+    room_filter = bridge.matrix_client.upload_filter.call_args.kwargs["room"]
+    assert room_filter["timeline"]["types"] == ["m.room.message"]
+    assert room_filter["state"]["lazy_load_members"]
+    assert set(room_filter["rooms"]) == bridge.monitored_rooms
+
+    # Fall back to an unfiltered sync if the homeserver rejects the filter
+    bridge.matrix_client.upload_filter.return_value = UploadFilterError("bad filter")
+    assert await bridge.upload_sync_filter() is None
+
+
+async def test_run_backfills_while_syncing(bridge, mocker: MockerFixture):
+    """Test that live sync starts without waiting for the history backfill."""
+    sync_started = asyncio.Event()
+
+    async def sync_forever(**kwargs):
+        sync_started.set()
+        await asyncio.sleep(3600)
+
+    async def fetch_historical_messages(self):
+        # Only returns once the live sync loop is already running
+        await asyncio.wait_for(sync_started.wait(), timeout=1)
+        raise Exception("Backfill Error")
+
+    mocker.patch.object(MatrixInfluxBridge, "connect_to_matrix", AsyncMock())
+    mocker.patch.object(
+        MatrixInfluxBridge, "fetch_historical_messages", fetch_historical_messages
+    )
+    bridge.matrix_client = MagicMock(
+        join=AsyncMock(),
+        upload_filter=AsyncMock(return_value=UploadFilterResponse(filter_id="f1")),
+        sync_forever=sync_forever,
+    )
+
+    # A failed backfill still stops the sync loop rather than leaking it
+    with pytest.raises(Exception, match="Backfill Error"):
+        await bridge.run()
+
+    bridge._flush_task.cancel()
+
+
+async def test_run_surfaces_sync_error_during_backfill(
+    bridge, mocker: MockerFixture
+):
+    """Test that a failed sync loop stops run() without waiting for backfill."""
+    backfill_cancelled = asyncio.Event()
+
+    async def sync_forever(**kwargs):
+        raise Exception("Sync Error")
+
+    async def fetch_historical_messages(self):
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            backfill_cancelled.set()
+            raise
+
+    mocker.patch.object(MatrixInfluxBridge, "connect_to_matrix", AsyncMock())
+    mocker.patch.object(
+        MatrixInfluxBridge, "fetch_historical_messages", fetch_historical_messages
+    )
+    bridge.matrix_client = MagicMock(
+        join=AsyncMock(),
+        upload_filter=AsyncMock(return_value=UploadFilterResponse(filter_id="f1")),
+        sync_forever=sync_forever,
+    )
+
+    with pytest.raises(Exception, match="Sync Error"):
+        await asyncio.wait_for(bridge.run(), timeout=1)
+
+    # The backfill is cancelled and has unwound by the time run() returns
+    assert backfill_cancelled.is_set()
+    bridge._flush_task.cancel()
+
+
+def test_store_messages_skips_duplicate_events(make_bridge, mock_messages):
+    """Test that an event delivered by both backfill and live sync is stored once."""
+    bridge = make_bridge()
+    rows = bridge.build_room_rows("!test1:matrix.org", mock_messages)
+
+    bridge.store_messages_in_db(rows)
+    bridge.store_messages_in_db(rows[:1])
+
+    with bridge.session_maker() as session:
+        stored = session.query(Message.event_id).order_by(Message.id).all()
+    assert [event_id for (event_id,) in stored] == [row["event_id"] for row in rows]
+
+
+def test_bridge_upgrades_message_table_without_event_id(
+    test_settings, make_bridge, mock_messages
+):
+    """Test a matrix_messages table from before event_id is upgraded in place."""
+    engine = create_engine(test_settings.database.url)
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE matrix_messages ("
+                "id INTEGER PRIMARY KEY, room_id VARCHAR(255) NOT NULL, "
+                "sender VARCHAR(255) NOT NULL, message_type VARCHAR(50) NOT NULL, "
+                "content TEXT, content_length INTEGER NOT NULL, "
+                "timestamp DATETIME NOT NULL, created_at DATETIME NOT NULL)"
+            )
+        )
+        connection.execute(
+            text(
+                "INSERT INTO matrix_messages (room_id, sender, message_type, "
+                "content_length, timestamp, created_at) VALUES "
+                "('!test1:matrix.org', '@old:matrix.org', 'RoomMessageText', 3, "
+                "'2024-01-01 00:00:00', '2024-01-01 00:00:00')"
+            )
+        )
+    engine.dispose()
+
+    bridge = make_bridge()
+    rows = bridge.build_room_rows("!test1:matrix.org", mock_messages)
+    bridge.store_messages_in_db(rows)
+    bridge.store_messages_in_db(rows)
+
+    with bridge.session_maker() as session:
+        stored = session.query(Message.event_id).order_by(Message.id).all()
+    assert [event_id for (event_id,) in stored] == [None] + [
+        row["event_id"] for row in rows
+    ]
+    # Opening the upgraded database again leaves it as it is
+    make_bridge()
+
+
+def test_load_sync_state_logs_each_room(bridge, caplog):
+    """Test that room sync positions are logged only when INFO is enabled."""
+    bridge.room_sync_times = {"!test1:matrix.org": "t1", "!test2:matrix.org": None}
+    bridge.save_sync_state()
+
+    with caplog.at_level(logging.INFO, logger="matrix_influx.matrix_to_influx"):
+        bridge.load_sync_state()
+    assert "Room !test1:matrix.org last sync time: t1" in caplog.messages
+    assert "Room !test2:matrix.org last sync time: Never" in caplog.messages
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="matrix_influx.matrix_to_influx"):
+        bridge.load_sync_state()
+    assert not caplog.messages
+
+
+async def test_connect_to_matrix_monitors_joined_rooms(bridge):
+    """Test that all joined rooms are monitored when none are configured."""
+    bridge.settings.matrix.room_ids = ()
+    bridge.monitored_rooms = frozenset()
+    bridge.matrix_client = MagicMock(
+        client_session=MagicMock(),
+        login=AsyncMock(return_value=MagicMock()),
+        joined_rooms=AsyncMock(
+            return_value=JoinedRoomsResponse(
+                rooms=["!test1:matrix.org", "!test2:matrix.org"]
+            )
+        ),
+    )
+
+    await bridge.connect_to_matrix()
+
+    assert bridge.monitored_rooms == {"!test1:matrix.org", "!test2:matrix.org"}
+
+    # Configured rooms are kept as they are
+    bridge.settings.matrix.room_ids = ("!test1:matrix.org",)
+    bridge.monitored_rooms = frozenset(bridge.settings.matrix.room_ids)
+    await bridge.connect_to_matrix()
+    assert bridge.monitored_rooms == {"!test1:matrix.org"}
+    bridge.matrix_client.joined_rooms.assert_called_once()